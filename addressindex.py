@@ -0,0 +1,129 @@
+#!/usr/bin/env python3.5
+from array import array
+from collections import defaultdict
+from itertools import groupby
+from typing import Iterable, List, Sequence
+
+# A confirmed transaction is kept as its position on the chain, the height of
+# its block and its index in there packed into one number
+INDEX_BITS = 32
+INDEX_MASK = (1 << INDEX_BITS) - 1
+
+
+def _positions() -> array:
+    return array('Q')
+
+
+# Keeps the balance and transactions of every address so wallet lookups
+# don't have to walk the whole chain
+class AddressIndex:
+    """
+    Confirmed(mined) and pending transactions are kept apart, so the pending
+    side can be dropped when a block is mined without touching the rest.
+    Confirmed transactions are only kept as their positions on the chain and
+    read back from it when asked for, so a chain kept compact(or on disk)
+    doesn't end up decoded in here. Pending ones are in memory anyway.
+
+    chain{Block[]} the chain the positions point into
+    """
+    def __init__(self, chain: Sequence[object]) -> None:
+        self.chain = chain
+        self.balances = defaultdict(int)
+        self.transactions = defaultdict(_positions)
+        self.pendingBalances = defaultdict(int)
+        self.pendingTransactions = defaultdict(list)
+
+    # Rebuilds an index from scratch, same walk getBalanceOfAddress used to do
+    @classmethod
+    def rebuild(cls, chain: Sequence[object], pendingTransactions: Iterable[object]) -> 'AddressIndex':
+        index = cls(chain)
+        for height, block in enumerate(chain):
+            index.addBlock(block, height)
+        for tx in pendingTransactions:
+            index.addPending(tx)
+        return index
+
+    # Books one transaction on the given balances and transaction lists,
+    # entry is what goes on the lists(the transaction or its position)
+    @staticmethod
+    def _book(tx: object, entry: object, balances: dict, transactions: dict) -> None:
+        # A mining reward has no sender(None), that's not an address
+        if tx.fromAddress is not None:
+            # The fee goes to the miner, as part of the block's reward
+            balances[tx.fromAddress] -= tx.amount + tx.fee
+            transactions[tx.fromAddress].append(entry)
+
+        if tx.toAddress is not None:
+            balances[tx.toAddress] += tx.amount
+            # Sending to yourself is still just one transaction in your list
+            if tx.toAddress != tx.fromAddress:
+                transactions[tx.toAddress].append(entry)
+
+    # Called every time a block is appended to the chain, at height
+    def addBlock(self, block: object, height: int) -> None:
+        for index, tx in enumerate(block.transactions):
+            self._book(tx, height << INDEX_BITS | index, self.balances, self.transactions)
+
+    # Called every time a transaction is added to the pending list
+    def addPending(self, tx: object) -> None:
+        self._book(tx, tx, self.pendingBalances, self.pendingTransactions)
+
+    # Called when a transaction leaves the pending list, to be mined or
+    # because the mempool dropped it
+    def removePending(self, tx: object) -> None:
+        if tx.fromAddress is not None:
+            self.pendingBalances[tx.fromAddress] += tx.amount + tx.fee
+            self.pendingTransactions[tx.fromAddress].remove(tx)
+        if tx.toAddress is not None:
+            self.pendingBalances[tx.toAddress] -= tx.amount
+            if tx.toAddress != tx.fromAddress:
+                self.pendingTransactions[tx.toAddress].remove(tx)
+
+    # Called once the pending transactions have been mined into a block
+    def clearPending(self) -> None:
+        self.pendingBalances = defaultdict(int)
+        self.pendingTransactions = defaultdict(list)
+
+    # Returns the balance of an address, O(1)
+    def getBalance(self, address: str, includePending=False) -> int:
+        balance = self.balances.get(address, 0)
+        if includePending:
+            balance += self.pendingBalances.get(address, 0)
+        return balance
+
+    # Returns the transactions of an address, O(k) in how many it has, every
+    # block they are in is read once
+    def getTransactions(self, address: str, includePending=False) -> List[object]:
+        txs = []
+        for height, positions in groupby(self.transactions.get(address, ()), lambda position: position >> INDEX_BITS):
+            transactions = self.chain[height].transactions
+            txs.extend(transactions[position & INDEX_MASK] for position in positions)
+        if includePending:
+            txs.extend(self.pendingTransactions.get(address, []))
+        return txs
+
+    # Compares this index with another one(usually a fresh rebuild)
+    def diff(self, other: 'AddressIndex') -> List[str]:
+        """
+        Returns a description of every address where the two indexes
+        disagree, an empty list means they match
+        """
+        problems = []
+        for name in ('balances', 'transactions', 'pendingBalances', 'pendingTransactions'):
+            mine, theirs = getattr(self, name), getattr(other, name)
+            for address in sorted(set(mine) | set(theirs), key=str):
+                ours = self._comparable(mine.get(address, mine.default_factory()))
+                expected = self._comparable(theirs.get(address, theirs.default_factory()))
+                if ours != expected:
+                    problems.append('{} of {}: {} != {}'.format(name, address, ours, expected))
+        return problems
+
+    # Confirmed transactions are compared on their positions(as height:index)
+    # and pending ones on their hashes
+    @staticmethod
+    def _comparable(value: object) -> object:
+        if isinstance(value, array):
+            return ['{}:{}'.format(position >> INDEX_BITS, position & INDEX_MASK) for position in value]
+        if isinstance(value, list):
+            return [tx.calculateHash() for tx in value]
+        return value
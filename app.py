@@ -2,125 +2,512 @@
 import json
 # import logging
 import os
+import queue
+import threading
 import time
-from typing import List
+import zlib
 from datetime import datetime
+from functools import wraps
+from hashlib import sha256
+from typing import List, Optional
 
 # import werkzeug.serving
-from fastecdsa import curve, ecdsa, keys
-from flask import Flask, jsonify, redirect, render_template, request, url_for
+from flask import (Flask, current_app, g, get_template_attribute, jsonify, make_response, redirect,
+                   render_template, request, session, stream_with_context, url_for)
+from markupsafe import Markup
+from werkzeug.local import LocalProxy
 # from gevent import pywsgi
 
 from blockchain import Blockchain, Transaction
+from chainstore import ChainStore, LazyChain
+from compact import CompactChain, unpackTransactions
+from events import EventBus
+from export import COMPRESSIONS, exportChain, fileChunks, importRecords, readRecords
+from hashing import targetToDifficulty
+from jobs import MiningJobs
+from metrics import CONTENT_TYPE, REGISTRY, SamplingProfiler
+from rendercache import RenderCache
+from sync import Syncer, packBlocks
+from wallet import Wallet
 # from console_log import ConsoleLog
 from flask_cors import *
 # from geventwebsocket.handler import WebSocketHandler
 
-# Initailizing the Flask app
-APP = Flask(__name__)
-# Configuring a secret key
-APP.config['SECRET_KEY'] = os.urandom(64)
-# Setting up CORS for AJAX calls
-cors = CORS(APP)
-
 # Initializing and configuring the logger
 # for both Python and Web Console
 # logger = logging.getLogger('console')
 # logger.setLevel(logging.DEBUG)
 
-# Your private key goes here
-PRIVATE_KEY = keys.gen_private_key(curve.secp256k1)
+# The settings create_app starts from, anything passed to it wins
+DEFAULT_CONFIG = {
+    # Configuring a secret key, sessions don't outlive the process unless
+    # REBELCOIN_SECRET_KEY is set
+    'SECRET_KEY': os.environ.get('REBELCOIN_SECRET_KEY') or os.urandom(64),
+    # Your private key goes here(hex), a new one is made on first use if not.
+    # From it we calculate your public key, which doubles as your wallet address.
+    'PRIVATE_KEY': os.environ.get('REBELCOIN_PRIVATE_KEY'),
+    # Whether a brand new chain gets the two demo transactions mined into it
+    'DEMO': os.environ.get('REBELCOIN_DEMO', '1') == '1',
+    # How many blocks the explorer shows at once, and the most the JSON route hands out
+    'BLOCKS_PER_PAGE': 20,
+    'MAX_BLOCKS_PER_PAGE': 100,
+    # How many rendered block cards and transaction tables to keep
+    'RENDER_CACHE_SIZE': 2048,
+    # How many transactions can wait to be mined, and how many go in one block
+    'MEMPOOL_SIZE': 10000,
+    'MAX_BLOCK_TRANSACTIONS': 500,
+    # Seconds a block should take to mine on average, and every how many
+    # blocks the target is worked out again to get there. Every node of a
+    # chain needs the same ones, they decide which blocks are valid.
+    'TARGET_BLOCK_TIME': 10,
+    'RETARGET_INTERVAL': 10,
+    # The most transactions one /_submit_transactions request can carry, and
+    # the biggest body it can have(checked before any of it is read)
+    'MAX_BULK_TRANSACTIONS': 10000,
+    'MAX_BULK_BYTES': 8 * 1024 * 1024,
+    # Number of processes signatures are checked on, for the bulk route and
+    # when validating the chain or blocks from peers
+    'VERIFICATION_WORKERS': 1,
+    # Seconds between keep-alive messages on an idle /_events stream
+    'EVENTS_KEEPALIVE': 15,
+    # Lets a request be profiled by adding ?_profile to it, the answer is then
+    # the stacks the request spent its time in. Off unless REBELCOIN_PROFILING=1,
+    # it shows the inside of the app to anyone asking.
+    'PROFILING': os.environ.get('REBELCOIN_PROFILING') == '1',
+    # Where the chain is kept on disk, without it the chain only lives as long
+    # as the process does
+    'CHAIN_STORE': os.environ.get('REBELCOIN_STORE'),
+    # Urls of the nodes to sync the chain from(comma separated in
+    # REBELCOIN_PEERS), every SYNC_INTERVAL seconds(0 only syncs when asked
+    # to through /_sync). Blocks from peers need at least SYNC_MIN_DIFFICULTY
+    # leading zeros, and at most MAX_SYNC_HEADERS blocks are taken from a peer
+    # in one sync.
+    'PEERS': [url for url in os.environ.get('REBELCOIN_PEERS', '').split(',') if url],
+    'SYNC_INTERVAL': 10,
+    'SYNC_MIN_DIFFICULTY': 1,
+    'MAX_SYNC_HEADERS': 2000,
+}
+
+
+# Everything an app works with. The wallet and the chain are only made when
+# something first needs them, so creating the app(and importing this module)
+# stays quick no matter how long the chain or how high the difficulty.
+class AppState:
+    """
+    app{Flask}
+    blockchain{Blockchain} optional, a chain to use instead of loading one
+    """
+    def __init__(self, app: Flask, blockchain: Optional[Blockchain] = None) -> None:
+        self.app = app
+        # Reentrant, seeding the demo needs the wallet while holding it
+        self._lock = threading.RLock()
+        self._blockchain = blockchain
+        self._ready = False
+        self._wallets = None
+        self._miningJobs = None
+        self._syncer = None
+        # New blocks, pending transactions and mining progress are pushed to
+        # the browsers listening on /_events
+        self.eventBus = EventBus()
+        # Mined blocks never change, so their rendered HTML is kept around
+        self.renderCache = RenderCache(app.config['RENDER_CACHE_SIZE'])
+
+    # Store all wallets(incase you use more than one), the first one is from
+    # PRIVATE_KEY or with a new key
+    @property
+    def wallets(self) -> List[Wallet]:
+        with self._lock:
+            if self._wallets is None:
+                configured = self.app.config['PRIVATE_KEY']
+                self._wallets = [Wallet.fromKey(configured) if configured else Wallet.generate()]
+            return self._wallets
+
+    # Your main wallet, it signs the transactions made on the site and gets
+    # the mining rewards
+    @property
+    def wallet(self) -> Wallet:
+        return self.wallets[0]
+
+    @property
+    def privateKey(self) -> int:
+        return self.wallet.privateKey
+
+    @property
+    def walletAddress(self) -> str:
+        return self.wallet.address
+
+    # The chain, loaded from the store(or started) on first use
+    @property
+    def blockchain(self) -> Blockchain:
+        with self._lock:
+            if not self._ready:
+                config = self.app.config
+                chain = self._blockchain
+                if chain is None and config['CHAIN_STORE']:
+                    chain = Blockchain(os.path.join(config['CHAIN_STORE'], 'checkpoint.json'),
+                                       LazyChain(ChainStore(config['CHAIN_STORE'])))
+                elif chain is None:
+                    # Kept in compact form, the whole chain stays in memory
+                    chain = Blockchain(chain=CompactChain())
+                chain.mempool.maxSize = config['MEMPOOL_SIZE']
+                chain.maxBlockTransactions = config['MAX_BLOCK_TRANSACTIONS']
+                chain.verificationWorkers = config['VERIFICATION_WORKERS']
+                chain.targetBlockTime = config['TARGET_BLOCK_TIME']
+                chain.retargetInterval = config['RETARGET_INTERVAL']
+                chain.addListener(self.eventBus.publish)
+                self._blockchain = chain
+                self._ready = True
+
+                # Only for a brand new chain, a stored one already has its blocks
+                if config['DEMO'] and len(chain.chain) == 1:
+                    self.seedDemo()
+                if config['PEERS'] and config['SYNC_INTERVAL']:
+                    self.syncer.start(config['SYNC_INTERVAL'])
+            return self._blockchain
+
+    # Keeps the chain in step with the PEERS, see sync.py
+    @property
+    def syncer(self) -> Syncer:
+        with self._lock:
+            if self._syncer is None:
+                self._syncer = Syncer(self.blockchain, self.app.config['PEERS'], self.app.config['SYNC_MIN_DIFFICULTY'],
+                                      maxHeaders=self.app.config['MAX_SYNC_HEADERS'])
+            return self._syncer
+
+    # Mining runs on a background thread, the routes only start and watch jobs
+    @property
+    def miningJobs(self) -> MiningJobs:
+        with self._lock:
+            if self._miningJobs is None:
+                self._miningJobs = MiningJobs(self.blockchain, listener=lambda job: self.eventBus.publish('mining', job.toDict()))
+            return self._miningJobs
+
+    ### Demo Transactions
+    def seedDemo(self) -> None:
+        """
+        Adds two transactions from your wallet and mines them into the
+        sample block of the demo
+        """
+        TX1 = Transaction(self.walletAddress, '123456789', 100)
+        self.wallet.sign(TX1)
+        self.blockchain.addTransaction(TX1)
+
+        TX2 = Transaction(self.walletAddress, '987654321', 50)
+        self.wallet.sign(TX2)
+        self.blockchain.addTransaction(TX2)
 
-# From that we can calculate your public key(which doubles as your wallet address)
-PUBLIC_KEY = keys.get_public_key(PRIVATE_KEY, curve.secp256k1)
-myWalletAddress = hex(int(str(PUBLIC_KEY.x)+str(PUBLIC_KEY.y)))
+        # Mine block
+        self.blockchain.minePendingTransactions(self.walletAddress)
+    ### End Demo Transactions
 
-# Create new instance of Blockchain class
-blockchain = Blockchain()
 
-### Demo Transactions
-# This Block creates the sample block in the Demo
-TX1 = Transaction(myWalletAddress, '123456789', 100)
-TX1.signTransaction(PRIVATE_KEY)
-try:
-    try:
-        blockchain.addTransaction(TX1)
-    except ecdsa.EcdsaError:
-        redirect('/', code=500)
-except:
-    redirect('/', code=500)
+# Returns the state of the app handling the request
+def state() -> AppState:
+    return current_app.extensions['rebelcoin']
 
+# The routes and helpers below were written against module globals, these
+# stand in for them and look up the current app's
+blockchain = LocalProxy(lambda: state().blockchain)
+miningJobs = LocalProxy(lambda: state().miningJobs)
+eventBus = LocalProxy(lambda: state().eventBus)
+renderCache = LocalProxy(lambda: state().renderCache)
+
+# What /metrics shows about the app, the chain's own metrics are made where
+# they are measured(blockchain.py, verification.py)
+REQUEST_SECONDS = REGISTRY.histogram('rebelcoin_request_seconds', 'Time to answer a request, by route', ['endpoint', 'method', 'status'])
 
-TX2 = Transaction(myWalletAddress, '987654321', 50)
-TX2.signTransaction(PRIVATE_KEY)
-try:
-    try:
-        blockchain.addTransaction(TX2)
-    except ecdsa.EcdsaError:
-        redirect('/', code=500)
-except:
-    redirect('/', code=500)
-
-# Mine block
-blockchain.minePendingTransactions(myWalletAddress)
-### End Demo Transactions
-
-# Store all wallet keys(incase you use more than one)
-walletKeys = []
-walletKeys.append({\
-    'name': 'Me',\
-    'PrivateKey': hex(PRIVATE_KEY),\
-    'PublicKey': hex(int(str(PUBLIC_KEY.x)+str(PUBLIC_KEY.y)))\
-    })
-BLOCKS = blockchain.chain
-SELECTEDBLOCK = 0
-SHOWINFOMESSAGE = True
-TRANSACTIONS = []
 # DIFFICULTY = blockchain.difficulty
 # REWARD = blockchain.miningReward
-JUSTADDEDTX = False
-NEWTX = None
+# The selected block, the intro message and the added transaction alert are
+# kept per visitor in the session(not in globals), so many people(and
+# threads) can use the app at once without stepping on each other
 
-# This helper method returns all transactions, if any, from the block passed
-def transacts(selectedBlock: int) -> List[Transaction]:
+# This helper method works out which blocks a page of the explorer shows
+def blockWindow(start, limit) -> tuple:
+    """
+    Returns (start, end) heights of the blocks to show, by default the
+    latest page of blocks
     """
-    Returns all the transactions, if any, from the passed block
+    height = blockchain.getHeight()
+    limit = max(1, min(limit or current_app.config['BLOCKS_PER_PAGE'], current_app.config['MAX_BLOCKS_PER_PAGE']))
+    if start is None:
+        start = height - limit
+    start = max(0, min(start, height - 1))
+    return start, min(start + limit, height)
+
+# Turns a block into the small header the explorer's JSON routes hand out
+def blockHeader(block, height: int) -> dict:
+    return {
+        'id': block.id,
+        'height': height,
+        'hash': block.hash,
+        'previousHash': block.previousHash,
+        'merkleRoot': block.merkleRoot,
+        'nonce': block.nonce,
+        'timestamp': block.timestamp,
+        # In hex, a 256 bit number doesn't survive JavaScript
+        'target': hex(block.target) if block.target is not None else None,
+        'transactionCount': len(block.transactions),
+    }
+
+# Builds a signed transaction from its JSON form, raises ValueError if it isn't one
+def transactionFromJSON(item) -> Transaction:
+    if not isinstance(item, dict):
+        raise ValueError('Transaction must be an object')
+    amount, fee, timestamp = item.get('amount'), item.get('fee', 0), item.get('timestamp')
+    if type(amount) is not int or type(fee) is not int or type(timestamp) is not int:
+        raise ValueError('Transaction amount, fee and timestamp must be integers')
+    fromAddress, toAddress, signature = item.get('fromAddress'), item.get('toAddress'), item.get('signature')
+    # Missing ones are turned away by Blockchain.addTransactions with a reason
+    if any(value is not None and not isinstance(value, str) for value in (fromAddress, toAddress, signature)):
+        raise ValueError('Transaction addresses and signature must be strings')
+    tx = Transaction(fromAddress, toAddress, amount, fee)
+    tx.timestamp = timestamp
+    tx.signature = signature
+    return tx
+
+# Raised by readTransactions for a body with too many transactions
+class TooManyTransactions(ValueError):
+    pass
+
+# Reads the transactions of a /_submit_transactions body, an entry that
+# can't be read stands as the ValueError saying why
+def readTransactions(body: bytes, contentType: str, limit: Optional[int] = None) -> list:
     """
-    trans = [block for block in BLOCKS if str(block.id) == str(selectedBlock)]
-    return trans[0].transactions
+    application/json is an array of transactions, application/x-ndjson one
+    transaction per line and application/octet-stream the compact binary
+    format of compact.packTransactions. Raises TooManyTransactions as soon
+    as there are more than limit, before they are built.
+    """
+    def checkCount(count: int) -> None:
+        if limit is not None and count > limit:
+            raise TooManyTransactions('At most {} transactions per request'.format(limit))
+
+    if contentType == 'application/octet-stream':
+        transactions = []
+        for tx in unpackTransactions(body):
+            checkCount(len(transactions) + 1)
+            transactions.append(tx.toTransaction())
+        return transactions
+
+    if contentType == 'application/x-ndjson':
+        lines = [line for line in body.decode('utf-8').splitlines() if line.strip()]
+        checkCount(len(lines))
+        items = []
+        for line in lines:
+            try:
+                items.append(json.loads(line))
+            except ValueError as error:
+                items.append(ValueError('Not valid JSON: {}'.format(error)))
+    else:
+        items = json.loads(body.decode('utf-8'))
+        if not isinstance(items, list):
+            raise ValueError('Expected an array of transactions')
+        checkCount(len(items))
+
+    transactions = []
+    for item in items:
+        try:
+            transactions.append(item if isinstance(item, ValueError) else transactionFromJSON(item))
+        except ValueError as error:
+            transactions.append(error)
+    return transactions
 
 # Just a variable to pass the server year to all the templates footer
 YEAR = '{0:%Y}'.format(datetime.now())
 
+# Renders the card of a block, from the cache if it was rendered before
+def blockCard(block) -> Markup:
+    selectedBlock = session.get('selectedBlock', 0)
+    selected = str(selectedBlock) == str(block.id)
+    return renderCache.getOrRender(('block', block.hash, selected), lambda: Markup(
+        current_app.jinja_env.get_template('block.html').render(block=block, selectedBlock=selectedBlock)))
+
+# Renders a transactions table, from the cache if there's a cacheKey and it
+# was rendered before. The key must change whenever the transactions do.
+def transactionsTable(transactions: List[Transaction], cacheKey=None) -> Markup:
+    render = lambda: get_template_attribute('macros.html', 'transactions_table')(transactions)
+    if cacheKey is None:
+        return render()
+    return renderCache.getOrRender(('transactions',) + tuple(cacheKey), render)
+
+# Works out the ETag of a page from everything it shows, the latest block,
+# the pending list and the visitor's own settings
+def pageETag() -> str:
+    with blockchain.lock:
+        version = (blockchain.getLatestBlock().hash, blockchain.pendingVersion)
+    parts = (request.full_path, version, session.get('selectedBlock', 0), session.get('showInfoMessage', True), session.get('justAddedTx', False))
+    return sha256(repr(parts).encode('utf-8')).hexdigest()
+
+# Decorator for pages that only change with the chain, sends an ETag and
+# Last-Modified and answers with 304 Not Modified if the client has the page
+def conditionalPage(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = pageETag()
+        lastModified = datetime.utcfromtimestamp(int(blockchain.lastModified))
+        if request.if_none_match.contains(etag) or (not request.if_none_match and request.if_modified_since is not None and lastModified <= request.if_modified_since.replace(tzinfo=None)):
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+        response.set_etag(etag)
+        response.last_modified = lastModified
+        # Always ask before reusing the page, the 304 makes that cheap
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    return wrapper
+
 ## Routing begins here, organisation is abit different than normal
 ## AJAX ROUTES
 # Route to select a block to see its transactions
-@APP.route('/_select_block', methods=['GET'])
 # @cross_origin(headers=['Content-Type'])
 def select_block():
     """
     Sets the selected block and displays it transactions
     """
-    global SELECTEDBLOCK, TRANSACTIONS
-    SELECTEDBLOCK = request.args.get('block_id', 0, type=int)
-    TRANSACTIONS = transacts(SELECTEDBLOCK)
-    return jsonify(result=SELECTEDBLOCK)
+    session['selectedBlock'] = request.args.get('block_id', 0, type=int)
+    return jsonify(result=session['selectedBlock'])
+
+# Route to page through the blocks on the chain
+def blocks():
+    """
+    Returns the headers of the blocks from height cursor on(limit of them),
+    with the cursors of the pages before and after it and the height of the
+    chain. Peers syncing from us read the headers from here too.
+    """
+    with blockchain.lock:
+        height = blockchain.getHeight()
+        start, end = blockWindow(request.args.get('cursor', None, type=int), request.args.get('limit', None, type=int))
+        headers = [blockHeader(block, start + i) for i, block in enumerate(blockchain.getChainSnapshot(start, end))]
+    return jsonify(blocks=headers,
+                   previous=max(0, start - (end - start)) if start > 0 else None,
+                   next=end if end < height else None,
+                   height=height)
+
+# Route for peers to fetch whole blocks from
+def block_bodies():
+    """
+    Returns count blocks from height start on, in the binary format of
+    sync.packBlocks
+    """
+    start = max(0, request.args.get('start', 0, type=int))
+    count = max(1, min(request.args.get('count', 1, type=int), current_app.config['MAX_BLOCKS_PER_PAGE']))
+    return current_app.response_class(packBlocks(blockchain.getChainSnapshot(start, start + count)), mimetype='application/octet-stream')
+
+# Route to stream the chain out as JSON lines
+def export_chain():
+    """
+    Streams the blocks from height start to end(not included), or only the
+    transactions of address, as JSON lines compressed with compression('none',
+    'gzip' or 'zstd'), see export.py. Nothing is built up front, so it
+    takes the same memory however much of the chain is asked for.
+    """
+    compression = request.args.get('compression', 'none')
+    if compression not in COMPRESSIONS:
+        return jsonify({'status': 400, 'message': 'Compression must be one of {}'.format(', '.join(sorted(COMPRESSIONS)))}), 400
+    chunks = exportChain(blockchain._get_current_object(), request.args.get('start', 0, type=int), request.args.get('end', None, type=int),
+                         request.args.get('address'), compression)
+    try:
+        # Started here, so a missing zstandard is a 400 rather than a broken stream
+        first = next(chunks, b'')
+    except ValueError as error:
+        return jsonify({'status': 400, 'message': str(error)}), 400
+
+    def stream():
+        yield first
+        yield from chunks
+
+    mimetype, extension = COMPRESSIONS[compression]
+    return current_app.response_class(stream(), mimetype=mimetype,
+                              headers={'Content-Disposition': 'attachment; filename=chain{}'.format(extension)})
+
+# Route to add the blocks of a full export on top of the chain
+def import_chain():
+    """
+    Reads an export(see export_chain) from the body as it comes in, the
+    compression is worked out from the content type. Blocks are checked
+    like the ones from a peer.
+    """
+    compression = next((name for name, (mimetype, _) in COMPRESSIONS.items() if mimetype == request.mimetype), 'none')
+    try:
+        added = importRecords(blockchain, readRecords(fileChunks(request.stream), compression), current_app.config['SYNC_MIN_DIFFICULTY'])
+    except (ValueError, KeyError, TypeError, zlib.error) as error:
+        return jsonify({'status': 400, 'message': str(error)}), 400
+    return jsonify({'status': 200, 'added': added, 'height': blockchain.getHeight()})
+
+# Route to sync the chain from the peers right away
+def sync_chain():
+    """
+    Takes the valid chain of the peers with the most work if it has more
+    than ours, and says how it went('synced', 'current' or 'failed')
+    """
+    result = state().syncer.syncOnce()
+    return jsonify({'status': 200, 'result': result, 'height': blockchain.getHeight()})
+
+# Turns an event from the bus into the small JSON delta sent to the browser,
+# rendered rows and cards come from the same cache the pages use
+def eventData(event: str, data) -> dict:
+    if event == 'block':
+        return dict(blockHeader(data['block'], data['height']), html=blockCard(data['block']))
+    if event == 'transaction':
+        tx = data['transaction']
+        return {
+            'index': data['index'],
+            'fromAddress': tx.fromAddress,
+            'toAddress': tx.toAddress,
+            'amount': tx.amount,
+            'fee': tx.fee,
+            'timestamp': tx.timestamp,
+            'html': get_template_attribute('macros.html', 'transaction_row')(data['index'], tx),
+        }
+    return data
+
+# Route that streams live updates(Server-Sent Events)
+def events():
+    """
+    Pushes 'block', 'transaction', 'pending' and 'mining' events as they
+    happen, so open pages can add rows instead of reloading
+    """
+    subscription = eventBus.subscribe()
+
+    def stream():
+        try:
+            # Tells the browser how long to wait before reconnecting
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    event, data = subscription.get(timeout=current_app.config['EVENTS_KEEPALIVE'])
+                except queue.Empty:
+                    # A comment line, keeps proxies from closing an idle stream
+                    yield ': keep-alive\n\n'
+                    continue
+                yield 'event: {}\ndata: {}\n\n'.format(event, json.dumps(eventData(event, data)))
+        finally:
+            eventBus.unsubscribe(subscription)
+
+    return current_app.response_class(stream_with_context(stream()), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Route for Prometheus(or anyone) to scrape
+def metrics():
+    """
+    Returns the metrics of the app and the chain in the Prometheus text format
+    """
+    return current_app.response_class(REGISTRY.render(), mimetype=None, content_type=CONTENT_TYPE)
 
 # Route to dismiss the alert intro message
-@APP.route('/_dismissInfo', methods=["GET"])
 def dismissInfo():
     """
     Sets showInfoMessage to false so that the message is not displayed
     in every page you visit
     """
-    global SHOWINFOMESSAGE
-    SHOWINFOMESSAGE = request.args.get('value')
+    session['showInfoMessage'] = request.args.get('value') == 'True'
     # logger.info({'status': 200, 'message': 'Dissmised'})
     return jsonify({'status': 200, 'message': 'Dissmised'})
 
 # Route to set the settings value
 ## TODO needs some more work
-@APP.route('/_set_settings', methods=['GET'])
 def set_settings():
     """
     Sets the difficulty and reward values for mining from the page to the code
@@ -135,45 +522,90 @@ def set_settings():
     return jsonify(difficulty=blockchain.difficulty, reward=blockchain.miningReward)
 
 # Route to create, sign and add Transactions to mining queue
-@APP.route('/_create_transaction', methods=['POST'])
 def create_transaction():
     """
-    Creates, signs and add transaction to pending queue waiting for mining
+    Creates, signs and add transaction to pending queue waiting for mining.
+    When the queue won't take it(full, too many from this wallet, already
+    pending..) the form comes back with the reason.
     """
-    global JUSTADDEDTX, NEWTX
-    JUSTADDEDTX = True
-    NEWTX = Transaction(myWalletAddress, request.form.get('toAddress'), int(request.form.get('amount')))
-    NEWTX.signTransaction(PRIVATE_KEY)
-    # This extra try/except is neccessary for the bug i havent been able to fix yet
+    newTx = Transaction(state().walletAddress, request.form.get('toAddress'), int(request.form.get('amount')), int(request.form.get('fee') or 0))
+    state().wallet.sign(newTx)
     try:
-        try:
-            blockchain.addTransaction(NEWTX)
-        except ecdsa.EcdsaError:
-            blockchain.addTransaction(NEWTX)
-    except:
-        try:
-            blockchain.addTransaction(NEWTX)
-        except ecdsa.EcdsaError:
-            blockchain.addTransaction(NEWTX)
+        blockchain.addTransaction(newTx)
+    except Exception as error:
+        return render_template('create-transaction.html', ownAddress=state().walletAddress, error=str(error)), 400
+    session['justAddedTx'] = True
     return redirect(url_for('pending'))
 
+# Route to add many signed transactions at once
+def submit_transactions():
+    """
+    Takes transactions signed elsewhere, as a JSON array, JSON lines or the
+    compact binary format(see readTransactions), and adds the valid ones to
+    the pending queue together. Returns the status of every transaction in
+    the order they came.
+    """
+    maxBytes = current_app.config['MAX_BULK_BYTES']
+    if request.content_length is not None and request.content_length > maxBytes:
+        return jsonify({'status': 413, 'message': 'At most {} bytes per request'.format(maxBytes)}), 413
+    try:
+        transactions = readTransactions(request.get_data(), request.mimetype, current_app.config['MAX_BULK_TRANSACTIONS'])
+    except TooManyTransactions as error:
+        return jsonify({'status': 413, 'message': str(error)}), 413
+    except (ValueError, UnicodeDecodeError) as error:
+        return jsonify({'status': 400, 'message': str(error)}), 400
+
+    readable = [tx for tx in transactions if isinstance(tx, Transaction)]
+    added = iter(blockchain.addTransactions(readable))
+    results = []
+    counts = {'added': 0, 'duplicate': 0, 'invalid': 0, 'rejected': 0}
+    for index, tx in enumerate(transactions):
+        if isinstance(tx, Transaction):
+            status, reason = next(added)
+            results.append({'index': index, 'status': status, 'hash': tx.calculateHash(), 'message': reason})
+        else:
+            status = 'invalid'
+            results.append({'index': index, 'status': status, 'hash': None, 'message': str(tx)})
+        counts[status] += 1
+
+    return jsonify(dict(counts, status=200, results=results))
+
 # Route to mine the queued transactions(pending transactions)
-@APP.route('/_mine_transactions', methods=['POST'])
 def mine_transactions():
     """
-    Mines all the transactions in the queue(pending transactions)
+    Starts mining all the transactions in the queue(pending transactions) in
+    the background and returns the id of the mining job straight away
+    """
+    session['justAddedTx'] = False
+    job = miningJobs.submit(state().walletAddress)
+    # logger.info({'status': 202, 'message': 'Mining'})
+    return jsonify({'status': 202, 'message': 'Mining', 'job': job.id}), 202
+
+# Route to see how far a mining job has come
+def mining_job(job_id):
+    """
+    Returns the status of a mining job, with the nonces tried, hash rate and
+    expected time left while it runs
     """
-    global JUSTADDEDTX
-    JUSTADDEDTX = False
-    blockchain.minePendingTransactions(myWalletAddress)
-    # logger.info({'status': 200, 'message': 'Mined'})
-    return jsonify({'status': 200, 'message': 'Mined'})
+    job = miningJobs.get(job_id)
+    if job is None:
+        return jsonify({'status': 404, 'message': 'No such mining job'}), 404
+    return jsonify(job.toDict())
+
+# Route to stop a mining job
+def cancel_mining_job(job_id):
+    """
+    Stops a queued or running mining job, its transactions go back to the queue
+    """
+    if not miningJobs.cancel(job_id):
+        return jsonify({'status': 409, 'message': 'Mining job is not running'}), 409
+    return jsonify({'status': 200, 'message': 'Cancelled'})
 ## END AJAX ROUTES
 
 ## Here begins the main routes for the templates
 ## MAIN ROUTES
 # Route to the index/main/front page of our app
-@APP.route("/")
+@conditionalPage
 def index():
     """
     Displays the index/main/front page for our app
@@ -183,66 +615,101 @@ def index():
     # logger.warning('Warning logged from Python')
     # logger.info('Info logged from Python')
     # logger.debug({'foo': ['bar', 'baz']})
-    return render_template('index.html', blocks=BLOCKS)
+    start, end = blockWindow(request.args.get('start', None, type=int), request.args.get('limit', None, type=int))
+    return render_template('index.html', blocks=blockchain.getChainSnapshot(start, end), start=start, end=end, height=blockchain.getHeight(), pageSize=end - start)
 
 # Route to the settings page
-@APP.route('/settings')
 def settings():
     """
-    Displays the template to set the difficulty and reward values
+    Displays the template to set the difficulty and reward values, the
+    difficulty only on chains from before targets(it's worked out from the
+    block times on the others)
     """
-    return render_template('settings.html', difficulty=blockchain.difficulty, reward=blockchain.miningReward)
+    adaptive = blockchain.getTargetAt(blockchain.getHeight()) is not None
+    difficulty = round(targetToDifficulty(blockchain.getMiningTarget()), 2) if adaptive else blockchain.difficulty
+    return render_template('settings.html', difficulty=difficulty, adaptive=adaptive, blockTime=blockchain.targetBlockTime, reward=blockchain.miningReward)
 
 # Route to the transaction creation form
-@APP.route('/new/transaction')
 def new_transaction():
     """
     Displays the template with the form to create transactions
     """
-    return render_template('create-transaction.html', ownAddress=myWalletAddress)
+    return render_template('create-transaction.html', ownAddress=state().walletAddress)
 
 # Route to transaction queue/pending transactions template
-@APP.route('/transactions/pending')
+@conditionalPage
 def pending():
     """
     Displays the template with all the transacions added to the queue
     or pending transactions
     """
-    return render_template('pending.html', pendingTransactions=blockchain.pendingTransactions, justAddedTx=JUSTADDEDTX)
+    with blockchain.lock:
+        pendingTransactions = blockchain.getPendingSnapshot()
+        cacheKey = ('pending', blockchain.pendingVersion)
+    return render_template('pending.html', pendingTransactions=pendingTransactions, cacheKey=cacheKey, justAddedTx=session.get('justAddedTx', False))
 
 # Route to wallet profile
-@APP.route("/wallet/<string:address>")
+@conditionalPage
 def wallet(address):
     """
     Displays the template with details about the given address
     incuding balance, transactions done
     """
-    balance = blockchain.getBalanceOfAddress(address)
-    transactions = blockchain.getAllTransactionsForWallet(address)
-    return render_template('wallet.html', walletAddress=address, myWalletAddress=myWalletAddress, balance=balance, transactions=transactions)
+    with blockchain.lock:
+        balance = blockchain.getBalanceOfAddress(address)
+        transactions = blockchain.getAllTransactionsForWallet(address)
+        cacheKey = ('wallet', address, blockchain.getLatestBlock().hash)
+    return render_template('wallet.html', walletAddress=address, myWalletAddress=state().walletAddress, balance=balance, transactions=transactions, cacheKey=cacheKey)
 ## END MAIN ROUTES
 
 
-# Contains all the context need in the overall app, not specific to route
-@APP.context_processor
-def context_processor():
-    def convert(timestamp: int) -> time:
-        """
-        Converts the time value(either int or str) into human readable
-        time and date
-        """
-        value = time.ctime(int(timestamp))
-        return value
+# Helpers for the templates that don't depend on the request, as globals
+# they also work in the cached fragments rendered outside a request's
+# context(as long as the app's context is there)
+def convert(timestamp: int) -> time:
+    """
+    Converts the time value(either int or str) into human readable
+    time and date
+    """
+    value = time.ctime(int(timestamp))
+    return value
 
-    def addressIsFromCurrentUser(address: str) -> bool:
-        if address == myWalletAddress:
+def addressIsFromCurrentUser(address: str) -> bool:
+    for wallet in state().wallets:
+        if address == wallet.address:
             return True
-        return False
-    return dict(blockchain=blockchain, showInfoMessage=SHOWINFOMESSAGE, convert=convert, year=YEAR, selectedBlock=SELECTEDBLOCK, transactions=TRANSACTIONS, addressIsFromCurrentUser=addressIsFromCurrentUser, enumerate=enumerate, str=str, type=type, json=json, len=len)
+    return False
+
+TEMPLATE_GLOBALS = dict(blockchain=blockchain, convert=convert, year=YEAR, addressIsFromCurrentUser=addressIsFromCurrentUser, blockCard=blockCard, transactionsTable=transactionsTable, enumerate=enumerate, str=str, type=type, json=json, len=len)
+
+# Starts timing(and maybe profiling) every request
+def start_request():
+    g.requestStart = time.perf_counter()
+    if current_app.config['PROFILING'] and '_profile' in request.args:
+        g.profiler = SamplingProfiler()
+        g.profiler.start()
+
+# Records how long the request took, and hands out the profile instead of the
+# page if one was asked for
+def finish_request(response):
+    if 'requestStart' in g:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.requestStart, endpoint=request.endpoint or 'none',
+                                method=request.method, status=response.status_code)
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
+        response = make_response(profiler.collapsed())
+        response.mimetype = 'text/plain'
+    return response
+
+# Contains all the context need in the overall app, not specific to route
+def context_processor():
+    selectedBlock = session.get('selectedBlock', 0)
+    block = blockchain.getBlockById(int(selectedBlock))
+    return dict(pendingCount=len(blockchain.mempool), showInfoMessage=session.get('showInfoMessage', True), selectedBlock=selectedBlock, transactions=block.transactions if block is not None else [], transactionsKey=('block', block.hash) if block is not None else None)
 
 ## Custom error handling pages, just for fun
 # 404 error handling template
-@APP.errorhandler(404)
 def not_found_error(error):
     """
     Render a custom 404 page that looks better than the original
@@ -251,7 +718,6 @@ def not_found_error(error):
     return render_template('404.html'), 404
 
 # 500 error handling template
-@APP.errorhandler(500)
 def internal_server_error(error):
     """
     Render a custom 500 page that looks better than the original
@@ -259,6 +725,70 @@ def internal_server_error(error):
     # logger.error('Server error, sorry, try reloading..!')
     return render_template('500.html'), 500
 
+# Every route of the app, as (rule, view, methods). The view's name is its
+# endpoint, the one url_for takes.
+ROUTES = [
+    ## AJAX ROUTES
+    ('/_select_block', select_block, ['GET']),
+    ('/_blocks', blocks, ['GET']),
+    ('/_block_bodies', block_bodies, ['GET']),
+    ('/_sync', sync_chain, ['POST']),
+    ('/_export', export_chain, ['GET']),
+    ('/_import', import_chain, ['POST']),
+    ('/_events', events, ['GET']),
+    ('/metrics', metrics, ['GET']),
+    ('/_dismissInfo', dismissInfo, ['GET']),
+    ('/_set_settings', set_settings, ['GET']),
+    ('/_create_transaction', create_transaction, ['POST']),
+    ('/_submit_transactions', submit_transactions, ['POST']),
+    ('/_mine_transactions', mine_transactions, ['POST']),
+    ('/_mining_jobs/<string:job_id>', mining_job, ['GET']),
+    ('/_mining_jobs/<string:job_id>/cancel', cancel_mining_job, ['POST']),
+    ## MAIN ROUTES
+    ('/', index, ['GET']),
+    ('/settings', settings, ['GET']),
+    ('/new/transaction', new_transaction, ['GET']),
+    ('/transactions/pending', pending, ['GET']),
+    ('/wallet/<string:address>', wallet, ['GET']),
+]
+
+# Builds the app, nothing heavy happens until the first request needs it
+def create_app(config: Optional[dict] = None, blockchain: Optional[Blockchain] = None) -> Flask:
+    """
+    config{dict} optional, settings that win over DEFAULT_CONFIG
+    blockchain{Blockchain} optional, a chain to serve instead of loading
+    one(from CHAIN_STORE) or starting a new one
+    """
+    # Initailizing the Flask app
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.update(config or {})
+    # Setting up CORS for AJAX calls
+    CORS(app)
+
+    appState = app.extensions['rebelcoin'] = AppState(app, blockchain)
+
+    for rule, view, methods in ROUTES:
+        app.add_url_rule(rule, view.__name__, view, methods=methods)
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.context_processor(context_processor)
+    app.register_error_handler(404, not_found_error)
+    app.register_error_handler(500, internal_server_error)
+    app.jinja_env.globals.update(TEMPLATE_GLOBALS)
+
+    # Registered again for every app, the latest one is what /metrics shows.
+    # A scrape mustn't load(or start) the chain, it's 0 until something has.
+    REGISTRY.gauge('rebelcoin_chain_height', 'Blocks on the chain', fn=lambda: appState.blockchain.getHeight() if appState._ready else 0)
+    REGISTRY.gauge('rebelcoin_mempool_transactions', 'Transactions waiting to be mined', fn=lambda: len(appState.blockchain.mempool) if appState._ready else 0)
+    REGISTRY.gauge('rebelcoin_event_listeners', 'Open /_events streams', fn=lambda: len(appState.eventBus))
+    REGISTRY.counter('rebelcoin_render_cache_hits_total', 'Fragments found in the render cache', fn=lambda: appState.renderCache.hits)
+    REGISTRY.counter('rebelcoin_render_cache_misses_total', 'Fragments rendered because they were not cached', fn=lambda: appState.renderCache.misses)
+    return app
+
+# The app `flask run` and WSGI servers pick up, cheap to create
+APP = create_app()
+
 # Create a console logging app by passing the app and
 # the logger object to the ConsoleLog class
 # APP = ConsoleLog(APP, logger)
@@ -278,4 +808,5 @@ def internal_server_error(error):
 # The main runnable function, calls the main function
 if __name__ == '__main__':
     # main()
-    APP.run()
+    # Blockchain is safe to share between threads, so requests don't have to queue
+    APP.run(threaded=True)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3.5
+"""
+Measures the memory a large synthetic chain takes with string-based
+transactions and kept in compact form, the way the app keeps a chain that
+isn't stored on disk, and what the address index built on the first
+getBalanceOfAddress adds to the compact one.
+
+Run it from the root of the project:
+    python -m benchmarks.bench_memory --transactions 100000
+"""
+import argparse
+import random
+import sys
+import tracemalloc
+from math import floor
+from time import time
+
+from fastecdsa import curve, keys
+
+from addressindex import AddressIndex
+from blockchain import Block, Transaction
+from compact import CompactChain
+
+# How many transactions go into each synthetic block
+BLOCK_SIZE = 1000
+
+
+# Builds the chain from a handful of wallets. Signing 100k transactions would
+# take minutes, so the signatures are random (r, s) pairs of the right size,
+# they take exactly as much memory as real ones.
+def syntheticChain(transactions: int, wallets=10) -> list:
+    rng = random.Random(0)
+    addresses = []
+    for _ in range(wallets):
+        publicKey = keys.get_public_key(rng.randrange(1, curve.secp256k1.q), curve.secp256k1)
+        addresses.append(hex(int(str(publicKey.x) + str(publicKey.y))))
+
+    blocks = [Block(floor(time()), [], '0')]
+    for start in range(0, transactions, BLOCK_SIZE):
+        txs = []
+        for _ in range(min(BLOCK_SIZE, transactions - start)):
+            tx = Transaction(rng.choice(addresses), rng.choice(addresses), rng.randrange(1, 1000))
+            tx.signature = hex(int(str(rng.randrange(10 ** 76, curve.secp256k1.q)) + str(rng.randrange(10 ** 76, curve.secp256k1.q))))
+            txs.append(tx)
+        blocks.append(Block(floor(time()), txs, blocks[-1].hash))
+    return blocks
+
+
+# Returns how much memory building something took, in bytes
+def measure(build) -> tuple:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transactions', type=int, default=100000, help='transactions on the chain')
+    args = parser.parse_args()
+
+    blocks, stringSize = measure(lambda: syntheticChain(args.transactions))
+    # The merkle trees aren't part of either format, take them out of the count
+    stringSize -= sum(sys.getsizeof(node) for block in blocks for level in block.merkleTree.levels for node in level)
+    # No decoded blocks kept around, only the compact ones are measured
+    compact, compactSize = measure(lambda: CompactChain(blocks, cacheSize=0))
+    # What stays around once the index is built, the blocks it decodes on the way go again
+    index, indexSize = measure(lambda: AddressIndex.rebuild(compact, []))
+
+    print('String based: {:>12,} bytes ({:,.0f} per transaction)'.format(stringSize, stringSize / args.transactions))
+    print('Compact:      {:>12,} bytes ({:,.0f} per transaction)'.format(compactSize, compactSize / args.transactions))
+    print('Ratio:        {:>12.1f}x'.format(stringSize / compactSize))
+    print('Address index:{:>12,} bytes ({:,.0f} per transaction)'.format(indexSize, indexSize / args.transactions))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3.5
+"""
+Compares the hashes per second of the different ways a block can be mined.
+
+Run it from the root of the project:
+    python -m benchmarks.bench_mining --nonces 200000 --workers 4
+"""
+import argparse
+import multiprocessing
+from hashlib import sha256
+from math import floor
+from time import perf_counter, time
+
+from blockchain import Block, Transaction
+from hashing import BlockHasher
+from mining import mineParallel
+
+# Leading zeros no hash will ever have, so every run tries exactly the number
+# of nonces it is given
+UNREACHABLE = 64
+# The same as a target, nothing is below 0
+UNREACHABLE_TARGET = 0
+
+
+# Builds a block with a few reward transactions in it, enough to make the
+# serialization part of each try visible
+def sampleBlock(transactions: int) -> Block:
+    txs = [Transaction(None, 'address-{}'.format(i), 100) for i in range(transactions)]
+    return Block(floor(time()), txs, '0' * 64)
+
+
+# The loop mineBlock used to run, which rebuilds the whole block string per try
+def benchRebuildLoop(block: Block, nonces: int) -> float:
+    start = perf_counter()
+    for nonce in range(nonces):
+        block.nonce = nonce
+        block.calculateHash()[0:UNREACHABLE]
+    return nonces / (perf_counter() - start)
+
+
+# The single process loop, which serializes the block once
+def benchPrefixLoop(block: Block, nonces: int) -> float:
+    prefix = block.calculateHashPrefix().encode('utf-8')
+    start = perf_counter()
+    for nonce in range(nonces):
+        sha256(prefix + str(nonce).encode('utf-8')).hexdigest()[0:UNREACHABLE]
+    return nonces / (perf_counter() - start)
+
+
+# The midstate engine mineBlock runs, which only feeds the nonce per try
+def benchMidstate(block: Block, nonces: int) -> float:
+    hasher = BlockHasher(block.calculateHashPrefix().encode('utf-8'))
+    start = perf_counter()
+    _, _, tries = hasher.search(UNREACHABLE_TARGET, maxNonce=nonces)
+    return tries / (perf_counter() - start)
+
+
+# The process pool search
+def benchParallel(block: Block, nonces: int, workers: int) -> float:
+    prefix = block.calculateHashPrefix().encode('utf-8')
+    start = perf_counter()
+    _, _, tries = mineParallel(prefix, UNREACHABLE_TARGET, workers, maxNonce=nonces)
+    return tries / (perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nonces', type=int, default=200000, help='nonces to try per run')
+    parser.add_argument('--transactions', type=int, default=50, help='transactions in the sample block')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), help='processes for the parallel run')
+    args = parser.parse_args()
+
+    block = sampleBlock(args.transactions)
+    print('Rebuild per try:        {:>12,.0f} H/s'.format(benchRebuildLoop(block, args.nonces)))
+    print('Serialize once:         {:>12,.0f} H/s'.format(benchPrefixLoop(block, args.nonces)))
+    print('Midstate engine:        {:>12,.0f} H/s'.format(benchMidstate(block, args.nonces)))
+    print('Parallel ({:>2} workers): {:>12,.0f} H/s'.format(args.workers, benchParallel(block, args.nonces * args.workers, args.workers)))
+
+
+if __name__ == '__main__':
+    main()
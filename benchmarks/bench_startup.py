@@ -0,0 +1,67 @@
+#!/usr/bin/env python3.5
+"""
+Times how long a fresh worker takes to come up: importing the app, creating
+it and answering its first request. Every run is a new process, so nothing
+is already imported or cached.
+
+Run it from the root of the project:
+    python -m benchmarks.bench_startup --runs 5 --budget 1.5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# What each fresh process runs, it prints the time every phase took as JSON
+CHILD = '''
+import json, sys
+from time import perf_counter
+start = perf_counter()
+import app
+imported = perf_counter()
+flaskApp = app.create_app({'DEMO': %(demo)r, 'CHAIN_STORE': %(store)r})
+created = perf_counter()
+response = flaskApp.test_client().get('/')
+answered = perf_counter()
+assert response.status_code == 200, response.status_code
+sys.stdout.write(json.dumps({'import': imported - start, 'createApp': created - imported,
+                             'firstRequest': answered - created, 'total': answered - start}) + '\\n')
+'''
+
+
+def runOnce(demo: bool, store) -> dict:
+    output = subprocess.check_output([sys.executable, '-c', CHILD % {'demo': demo, 'store': store}],
+                                     cwd=os.getcwd(), stderr=subprocess.DEVNULL)
+    # Mining logs to stdout too, the timings are the last line
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes to time')
+    parser.add_argument('--demo', action='store_true', help='seed and mine the demo block on the first request')
+    parser.add_argument('--store', help='chain store to load, like REBELCOIN_STORE')
+    parser.add_argument('--budget', type=float, help='fail if the median total(seconds) goes over this')
+    parser.add_argument('--output', help='file to write the results to as JSON')
+    args = parser.parse_args()
+
+    runs = [runOnce(args.demo, args.store) for _ in range(args.runs)]
+    medians = {phase: statistics.median(run[phase] for run in runs) for phase in runs[0]}
+
+    for phase, seconds in medians.items():
+        print('{:>14} {:8.3f}s'.format(phase, seconds))
+
+    if args.output:
+        with open(args.output, 'w') as outFile:
+            json.dump({'parameters': vars(args), 'median': medians, 'runs': runs}, outFile, indent=2, sort_keys=True)
+            outFile.write('\n')
+
+    if args.budget is not None and medians['total'] > args.budget:
+        print('Startup took {:.3f}s, over the {:.3f}s budget'.format(medians['total'], args.budget))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3.5
+"""
+Times the main operations of the chain and the app on a synthetic chain
+(see benchmarks/synthetic.py) and writes the results as JSON, so runs on
+different commits can be compared.
+
+Run it from the root of the project:
+    python -m benchmarks.bench_suite --blocks 20 --transactions 50 --output before.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+from time import perf_counter, time
+
+from blockchain import Block, Transaction
+from verification import decodePublicKey, signatureCache
+from wallet import Wallet
+
+from benchmarks.synthetic import syntheticChain, syntheticTransactions
+
+
+# Runs fn repeat times and returns the fastest, in seconds
+def timed(fn, repeat=3) -> float:
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        fn()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def result(seconds: float, ops: int) -> dict:
+    return {'seconds': round(seconds, 6), 'ops': ops, 'perSecond': round(ops / seconds, 2) if seconds > 0 else None}
+
+
+def benchHashing(chain, count: int) -> dict:
+    block = chain.getLatestBlock()
+    def run():
+        for _ in range(count):
+            block.calculateHash()
+    return result(timed(run), count)
+
+
+# Mines copies of the latest block from scratch, counting every nonce tried
+def benchMining(chain, blocks: int, difficulty: int) -> dict:
+    latest = chain.getLatestBlock()
+    tries = [0]
+    start = perf_counter()
+    for i in range(blocks):
+        block = Block(latest.timestamp + i + 1, latest.transactions, latest.hash)
+        block.mineBlock(difficulty, progress=lambda count: tries.__setitem__(0, tries[0] + count))
+    return dict(result(perf_counter() - start, tries[0]), blocks=blocks, difficulty=difficulty)
+
+
+def benchSigning(wallets, count: int) -> dict:
+    # Signing is deterministic, so every round signs the exact same work
+    return result(timed(lambda: syntheticTransactions(wallets, count, seed=1)), count)
+
+
+# Signs a batch from one wallet in a single call, the way payouts do
+def benchSignMany(wallets, count: int) -> dict:
+    privateKey, address = wallets[0]
+    transactions = [Transaction(address, wallets[i % len(wallets)][1], i + 1) for i in range(count)]
+    return result(timed(lambda: Wallet(privateKey).signMany(transactions)), count)
+
+
+def benchVerifying(wallets, count: int) -> dict:
+    transactions = syntheticTransactions(wallets, count, seed=2)
+    def cold():
+        signatureCache.clear()
+        decodePublicKey.cache_clear()
+        for tx in transactions:
+            tx.isValid()
+    def warm():
+        for tx in transactions:
+            tx.isValid()
+    return {'cold': result(timed(cold), count), 'cached': result(timed(warm), count)}
+
+
+def benchBalances(chain, wallets, lookups: int) -> dict:
+    addresses = [address for _, address in wallets]
+    def cold():
+        chain._addressIndex = None
+        chain.getBalanceOfAddress(addresses[0])
+    def warm():
+        for i in range(lookups):
+            chain.getBalanceOfAddress(addresses[i % len(addresses)], includePending=True)
+    return {'indexBuild': result(timed(cold), 1), 'lookups': result(timed(warm), lookups)}
+
+
+def benchValidation(chain) -> dict:
+    transactions = sum(len(block.transactions) for block in chain.chain)
+    def cold():
+        signatureCache.clear()
+        decodePublicKey.cache_clear()
+        assert chain.isChainValid(fullAudit=True)
+    def warm():
+        assert chain.isChainValid(fullAudit=True)
+    return {'cold': result(timed(cold), transactions), 'cached': result(timed(warm), transactions)}
+
+
+# Requests the main pages through Flask's test client, with an app serving
+# the synthetic chain
+def benchRoutes(chain, wallets, requests: int) -> dict:
+    from app import create_app
+
+    client = create_app({'DEMO': False}, chain).test_client()
+    routes = {
+        'index': '/',
+        'pending': '/transactions/pending',
+        'wallet': '/wallet/{}'.format(wallets[0][1]),
+        'blocks': '/_blocks',
+    }
+
+    results = {}
+    for name, url in routes.items():
+        def run():
+            for _ in range(requests):
+                response = client.get(url)
+                assert response.status_code == 200, '{} answered {}'.format(url, response.status_code)
+        results[name] = result(timed(run), requests)
+    return results
+
+
+def currentCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--blocks', type=int, default=20, help='blocks on the synthetic chain')
+    parser.add_argument('--transactions', type=int, default=50, help='transactions per block')
+    parser.add_argument('--wallets', type=int, default=10, help='wallets sending and receiving')
+    parser.add_argument('--seed', type=int, default=0, help='seed the chain is generated from')
+    parser.add_argument('--difficulty', type=int, default=3, help='difficulty of the mining benchmark')
+    parser.add_argument('--mine-blocks', type=int, default=3, help='blocks mined by the mining benchmark')
+    parser.add_argument('--hashes', type=int, default=10000, help='calls to Block.calculateHash')
+    parser.add_argument('--signatures', type=int, default=200, help='transactions signed and verified')
+    parser.add_argument('--lookups', type=int, default=10000, help='balance lookups')
+    parser.add_argument('--requests', type=int, default=50, help='requests per route')
+    # Not stdout, mining logs there
+    parser.add_argument('--output', default='benchmark-results.json', help='file to write the results to')
+    args = parser.parse_args()
+
+    buildStart = perf_counter()
+    # The chain is mined at difficulty 1, it only has to be valid
+    chain, wallets = syntheticChain(args.blocks, args.transactions, args.wallets, 1, args.seed)
+    buildTime = perf_counter() - buildStart
+
+    results = {
+        'chainBuild': result(buildTime, args.blocks),
+        'calculateHash': benchHashing(chain, args.hashes),
+        'mineBlock': benchMining(chain, args.mine_blocks, args.difficulty),
+        'signTransaction': benchSigning(wallets, args.signatures),
+        'signMany': benchSignMany(wallets, args.signatures),
+        'isValid': benchVerifying(wallets, args.signatures),
+        'getBalanceOfAddress': benchBalances(chain, wallets, args.lookups),
+        'isChainValid': benchValidation(chain),
+        'routes': benchRoutes(chain, wallets, args.requests),
+    }
+
+    report = {
+        'generatedAt': int(time()),
+        'commit': currentCommit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': vars(args),
+        # Same seed and sizes give the same tip, so this tells if two runs
+        # measured the same chain
+        'chainTip': chain.getLatestBlock().hash,
+        'results': results,
+    }
+
+    with open(args.output, 'w') as outFile:
+        json.dump(report, outFile, indent=2, sort_keys=True)
+        outFile.write('\n')
+    print('Results written to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
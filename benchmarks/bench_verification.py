@@ -0,0 +1,102 @@
+#!/usr/bin/env python3.5
+"""
+Times full-chain signature checks. The baseline is the original check, a
+copy of Transaction.isValid from before the batched pipeline (split at 77
+digits, nothing cached). "one by one" is today's Transaction.isValid in a
+loop, with its caches emptied first, and "batched" and "parallel" are the
+pipeline on one and on many processes.
+
+Run it from the root of the project:
+    python -m benchmarks.bench_verification --sizes 1000 10000 100000
+"""
+import argparse
+import multiprocessing
+from math import floor
+from time import perf_counter, time
+
+from fastecdsa import curve, ecdsa, keys
+
+from blockchain import Block, CurvePoint, Transaction
+from verification import decodePublicKey, findInvalidTransaction, signatureCache
+
+# How many transactions go into each synthetic block
+BLOCK_SIZE = 1000
+
+
+# Builds a chain of signed transactions from a single wallet, the blocks are
+# not mined as only the signatures matter here
+def syntheticChain(transactions: int) -> list:
+    privateKey = keys.gen_private_key(curve.secp256k1)
+    publicKey = keys.get_public_key(privateKey, curve.secp256k1)
+    address = hex(int(str(publicKey.x) + str(publicKey.y)))
+
+    blocks = [Block(floor(time()), [], '0')]
+    txs = []
+    for i in range(transactions):
+        tx = Transaction(address, 'address-{}'.format(i), i + 1)
+        tx.signTransaction(privateKey)
+        txs.append(tx)
+        if len(txs) == BLOCK_SIZE:
+            blocks.append(Block(floor(time()), txs, blocks[-1].hash))
+            txs = []
+    if txs:
+        blocks.append(Block(floor(time()), txs, blocks[-1].hash))
+    return blocks
+
+
+# The original Transaction.isValid, kept as it was so the baseline doesn't
+# move when the verification code does. Signatures whose r isn't 77 digits
+# fail it, they still cost a check.
+def originalIsValid(tx: Transaction) -> bool:
+    if tx.fromAddress == None:
+        return True
+    r, s = int(str(int(tx.signature, 0))[:77]), int(str(int(tx.signature, 0))[77:])
+    pub_key = CurvePoint(int(str(int(tx.fromAddress, 0))[:77]), int(str(int(tx.fromAddress, 0))[77:]))
+    try:
+        return ecdsa.verify((r, s), tx.calculateHash(), pub_key, curve=curve.secp256k1)
+    except ecdsa.EcdsaError:
+        return False
+
+
+# What isChainValid did before the pipeline, every transaction on its own
+def benchOriginal(blocks: list) -> float:
+    start = perf_counter()
+    for block in blocks[1:]:
+        for tx in block.transactions:
+            originalIsValid(tx)
+    return perf_counter() - start
+
+
+# Today's check of one transaction in a loop, from cold caches
+def benchSequential(blocks: list) -> float:
+    decodePublicKey.cache_clear()
+    signatureCache.clear()
+    start = perf_counter()
+    for block in blocks[1:]:
+        block.hasValidTransactions()
+    return perf_counter() - start
+
+
+def benchPipeline(blocks: list, workers: int) -> float:
+    decodePublicKey.cache_clear()
+    signatureCache.clear()
+    start = perf_counter()
+    findInvalidTransaction(blocks, workers, start=1)
+    return perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='transactions per chain')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), help='processes for the parallel run')
+    args = parser.parse_args()
+
+    print('{:>8} {:>12} {:>12} {:>12} {:>12}'.format('txs', 'original', 'one by one', 'batched', 'parallel'))
+    for size in args.sizes:
+        blocks = syntheticChain(size)
+        print('{:>8} {:>11.2f}s {:>11.2f}s {:>11.2f}s {:>11.2f}s'.format(
+            size, benchOriginal(blocks), benchSequential(blocks), benchPipeline(blocks, 1), benchPipeline(blocks, args.workers)))
+
+
+if __name__ == '__main__':
+    main()
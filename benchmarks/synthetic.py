@@ -0,0 +1,62 @@
+#!/usr/bin/env python3.5
+"""
+Builds synthetic chains for the benchmarks. The same arguments always give
+the same chain: the keys come from a seeded generator, the timestamps are
+fixed and fastecdsa signs deterministically(RFC 6979), so every block and
+transaction hash is the same from one run to the next.
+"""
+import random
+from typing import List, Tuple
+
+from fastecdsa import curve
+
+from blockchain import Block, Blockchain, Transaction
+from wallet import publicAddress
+
+# Every timestamp counts up from here instead of the clock
+BASE_TIME = 1500000000
+
+
+# Makes wallets as (private key, address) pairs
+def syntheticWallets(count: int, seed=0) -> List[Tuple[int, str]]:
+    rng = random.Random(seed)
+    wallets = []
+    for _ in range(count):
+        privateKey = rng.randrange(1, curve.secp256k1.q)
+        wallets.append((privateKey, publicAddress(privateKey)))
+    return wallets
+
+
+# Makes signed transactions between the given wallets
+def syntheticTransactions(wallets: List[Tuple[int, str]], count: int, seed=0, startTime=BASE_TIME) -> List[Transaction]:
+    rng = random.Random(seed)
+    transactions = []
+    for i in range(count):
+        privateKey, fromAddress = rng.choice(wallets)
+        tx = Transaction(fromAddress, rng.choice(wallets)[1], rng.randrange(1, 1000), rng.randrange(0, 5))
+        tx.timestamp = startTime + i
+        tx.signTransaction(privateKey)
+        transactions.append(tx)
+    return transactions
+
+
+# Makes a chain of mined blocks full of signed transactions
+def syntheticChain(blocks: int, transactionsPerBlock: int, wallets=10, difficulty=1, seed=0) -> Tuple[Blockchain, List[Tuple[int, str]]]:
+    """
+    Returns the chain(genesis plus the given number of blocks, each with a
+    mining reward on top of its transactions) and the wallets that were used
+    """
+    walletKeys = syntheticWallets(wallets, seed)
+    chain = Blockchain(chain=[Block(BASE_TIME, [], '0')])
+    chain.difficulty = difficulty
+
+    rng = random.Random(seed)
+    for height in range(1, blocks + 1):
+        startTime = BASE_TIME + height * transactionsPerBlock
+        txs = syntheticTransactions(walletKeys, transactionsPerBlock, rng.randrange(2 ** 32), startTime)
+        reward = Transaction(None, rng.choice(walletKeys)[1], chain.miningReward + sum(tx.fee for tx in txs))
+        reward.timestamp = startTime
+        block = Block(startTime, txs + [reward], chain.getLatestBlock().hash)
+        block.mineBlock(difficulty)
+        chain.addMinedBlock(block)
+    return chain, walletKeys
@@ -3,18 +3,39 @@
 import base64
 import itertools
 import json
+import os
+import threading
 from hashlib import sha256
 from math import floor
-from time import time
-from typing import List
-
-from fastecdsa import curve, ecdsa, keys
+from time import perf_counter, time
+from typing import List, Optional, Tuple
 
+from addressindex import AddressIndex
 from console_logging.console import Console
+from hashing import CHECK_INTERVAL, MAX_TARGET, BlockHasher, difficultyToTarget, hashMeetsTarget, retarget, targetWork
+from mempool import Mempool
+from merkle import MerkleTree
+from metrics import REGISTRY
+from mining import AnyEvent, mineParallel
+from verification import findInvalidTransaction, verifySignature, verifySignatures
+from wallet import publicAddress, signHash
 # A cool terminal output logger
 # initialized
 console = Console()
 
+# Mining metrics, see metrics.py
+HASH_ATTEMPTS = REGISTRY.counter('rebelcoin_hash_attempts_total', 'Nonces tried while mining')
+BLOCKS_MINED = REGISTRY.counter('rebelcoin_mining_runs_total', 'Blocks mining was started on, by how it ended', ['outcome'])
+HASH_RATE = REGISTRY.gauge('rebelcoin_hash_rate', 'Nonces per second while mining the last block')
+MINING_SECONDS = REGISTRY.histogram('rebelcoin_mining_seconds', 'Time spent mining a block',
+                                    buckets=(0.01, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0))
+
+# A block's timestamp can't be below the median of the timestamps of this many
+# blocks before it, nor more than MAX_FUTURE_SECONDS ahead of our clock. The
+# timestamps steer the target, so they can't be made up freely.
+MEDIAN_TIME_BLOCKS = 11
+MAX_FUTURE_SECONDS = 120
+
 # A helper class for the little hack i did with the ecdsa public keys
 # This converts it hex back to points in a the curve secp256k1
 class CurvePoint:
@@ -39,18 +60,43 @@ class Block:
     timestamp{number}
     transactions{Transaction[]}
     previousHash{string}
+    merkleTree{MerkleTree} optional, built from the transactions if not given
+    target{number} optional, the hash has to be below it(see
+    Blockchain.getTargetAt). Blocks of chains from before targets have
+    none and are mined at a difficulty instead.
     """
+    # No per instance __dict__, we keep every block in memory
+    __slots__ = ('id', 'previousHash', 'timestamp', 'transactions', 'merkleTree', 'merkleRoot', 'target', 'nonce', 'hash')
     # Creates an instance of an iterable for the class ids
     block_id = itertools.count()
     # Initialize a class with all the required values
-    def __init__(self, timestamp: int, transactions: List[object], previousHash='') -> None:
+    def __init__(self, timestamp: int, transactions: List[object], previousHash='', merkleTree=None, target=None) -> None:
         self.id = next(self.block_id)
         self.previousHash = previousHash
         self.timestamp = timestamp
         self.transactions = transactions
+        self.merkleTree = merkleTree if merkleTree is not None else MerkleTree.fromTransactions(transactions)
+        self.merkleRoot = self.merkleTree.root()
+        self.target = target
         self.nonce = 0
         self.hash = self.calculateHash()
 
+    # This method builds the part of the data this block hashes that stays the
+    # same while mining, which is everything except the nonce
+    def calculateHashPrefix(self) -> str:
+        """
+        Returns the previous hash, timestamp, merkle root and target of this
+        block as one string, ready to have the nonce appended. The
+        transactions are covered by the merkle root, so this doesn't grow with
+        them.
+        """
+        prefix = str(self.previousHash) + str(self.timestamp) + self.merkleRoot
+        # Only hashed when there is one, so blocks from before targets keep
+        # their hashes. The separators keep it apart from the nonce.
+        if self.target is not None:
+            prefix += '/{}/'.format(self.target)
+        return prefix
+
     # This method calculates the hash this block will store as/for reference of
     # the previous hash, transactions, timestamp and nonce
     def calculateHash(self) -> str:
@@ -58,32 +104,83 @@ class Block:
         Returns the SHA256 of this block(by processing all the data stored
         inside this block)
         """
-        # The try/except code block is for the times when the transactions are empty
-        # and the json.dumps method returns a type error, hence, string it!!
-        try:
-            temp = str(self.previousHash) + str(self.timestamp) + json.dumps(self.transactions) + str(self.nonce)
-        except TypeError:
-            temp = str(self.previousHash) + str(self.timestamp) + str(self.transactions) + str(self.nonce)
-        
+        temp = self.calculateHashPrefix() + str(self.nonce)
         return sha256(temp.encode('utf-8')).hexdigest()
 
     # Method to mine our *pending transactions in blocks after signing
-    def mineBlock(self, difficulty: int) -> None:
+    def mineBlock(self, difficulty: int, workers=1, progress=None, stop=None) -> bool:
         """
         Starts the mining process on the block. It changes the 'nonce' until the hash
-        of the block starts with enough zeros(=difficulty)
-        """
-        # Here the logic(Proof Of Work/PoW) is that the method has to
-        # find the hash that has the exact amout of zeros in the beginning
-        # as to the difficulty amount
-        # the higher the difficulty, the longer the time taken
-        ## TODO - Try using lru_cache function to speed up process(But why!)
-        while self.hash[0:difficulty] != str('0' * difficulty):
-            # Increment the nonce by 1 each time to see the loop count
-            self.nonce += 1
-            self.hash = self.calculateHash()
+        of the block is below its target, or for a block without one starts
+        with enough zeros(=difficulty). With more than one
+        worker the nonces are searched on that many processes at once.
+        progress is called with the number of new nonces tried every so often,
+        and setting stop(an Event) ends the search early, in which case this
+        returns false and the block is left unmined.
+        """
+        # The transactions don't change while mining, so they are serialized
+        # once here instead of on every try
+        prefix = self.calculateHashPrefix().encode('utf-8')
+        target = self.target if self.target is not None else difficultyToTarget(difficulty)
+        start = perf_counter()
+
+        if workers > 1:
+            nonce, digest, tries = mineParallel(prefix, target, workers, self.nonce, stop=stop, progress=progress)
+        else:
+            # Here the logic(Proof Of Work/PoW) is that the method has to
+            # find a hash below the target, which is the same as having the
+            # exact amout of zeros in the beginning as to the difficulty amount
+            # the lower the target, the longer the time taken
+            nonce, digest, tries = BlockHasher(prefix).search(target, self.nonce, stop=stop, progress=progress)
+            # The search only reports whole batches, this is the rest
+            if progress is not None:
+                progress(tries % CHECK_INTERVAL)
+            digest = digest.hex() if digest is not None else None
+
+        elapsed = perf_counter() - start
+        HASH_ATTEMPTS.inc(tries)
+        if elapsed > 0:
+            HASH_RATE.set(tries / elapsed)
+
+        if nonce is None:
+            BLOCKS_MINED.inc(outcome='stopped')
+            console.info('Mining stopped')
+            return False
+
+        BLOCKS_MINED.inc(outcome='mined')
+        MINING_SECONDS.observe(elapsed)
 
+        self.nonce, self.hash = nonce, digest
         console.info('Block mined: {}'.format(self.hash))
+        return True
+
+    # Method that checks the stored merkle root still matches the transactions
+    def hasValidMerkleRoot(self) -> bool:
+        """
+        Rebuilds the merkle tree from the transactions and compares roots, the
+        block hash only covers the root so this is what catches tampered
+        transactions. A transaction that is in the block twice makes it
+        invalid too, repeating the last one doesn't change the root.
+        """
+        hashes = [tx.calculateHash() for tx in self.transactions]
+        if len(set(hashes)) != len(hashes):
+            return False
+        return MerkleTree.fromHashes(hashes).root() == self.merkleRoot
+
+    # Method that checks every field holds what it should, for blocks that
+    # come from elsewhere(see Blockchain.replaceBlocks)
+    def hasValidTypes(self) -> bool:
+        return (type(self.timestamp) is int and type(self.nonce) is int and isinstance(self.previousHash, str) and
+                isinstance(self.hash, str) and isinstance(self.merkleRoot, str) and (self.target is None or type(self.target) is int) and
+                isinstance(self.transactions, list) and all(isinstance(tx, Transaction) and tx.hasValidTypes() for tx in self.transactions))
+
+    # Builds the proof that the transaction at index is part of this block
+    def getTransactionProof(self, index: int) -> List[Tuple[str, bool]]:
+        """
+        Returns a merkle inclusion proof for the transaction at index. Check it
+        with merkle.verifyProof(tx.calculateHash(), proof, block.merkleRoot)
+        """
+        return self.merkleTree.getProof(index)
 
     # Method that checks ifthe transactions in the block are all valid(Incuding Reward)
     def hasValidTransactions(self) -> bool:
@@ -105,20 +202,36 @@ class Transaction:
     fromAddress{string}
     toAddress{string}
     amount{number}
+    fee{number} optional, paid by the sender to whoever mines the block
    """
+    # No per instance __dict__, we keep every transaction in memory
+    __slots__ = ('id', 'fromAddress', 'toAddress', 'amount', 'fee', 'timestamp', 'signature')
     # Creates an instance of an iterable for the class ids
     trans_id = itertools.count()
     # Initialize a class with all the required values
-    def __init__(self, fromAddress: str, toAddress: str, amount: int) -> None:
+    def __init__(self, fromAddress: str, toAddress: str, amount: int, fee=0) -> None:
         self.id = next(self.trans_id)
         self.fromAddress = fromAddress
         self.toAddress = toAddress
         self.amount = amount
+        self.fee = fee
         self.timestamp = floor(time())
+        self.signature = None
+
+    # Checks every field holds what it should, the hash can't tell 5 from '5'
+    def hasValidTypes(self) -> bool:
+        return (type(self.amount) is int and type(self.fee) is int and type(self.timestamp) is int and
+                isinstance(self.toAddress, str) and (self.fromAddress is None or isinstance(self.fromAddress, str)) and
+                (self.signature is None or isinstance(self.signature, str)))
 
     # Calculate the hash for our Transaction returning a hex string
     def calculateHash(self) -> str:
         temp = str(self.fromAddress) + str(self.toAddress) + str(self.amount) + str(self.timestamp)
+        # Only hashed when there is one, so transactions from before fees
+        # existed keep their hashes(and signatures). The separator keeps its
+        # digits apart from the timestamp's, or the two could be re-split.
+        if self.fee:
+            temp += '/fee:{}'.format(self.fee)
         return sha256(temp.encode('utf-8')).hexdigest()
 
     # Signs our Transaction with our signing key/private keyy(generated)
@@ -127,24 +240,18 @@ class Transaction:
         You can only send a transaction from the wallet that is linked to your
         key. So here we check if the fromAddress matches your publicKey
         """
-        # Get our public key from the private/signing key
-        pub_key = keys.get_public_key(signingKey, curve.secp256k1)
-        # Turn it to a hex key for easy handling
-        pub_key_hex = hex(int(str(pub_key.x)+str(pub_key.y)))
+        # Get our public key from the private/signing key, as a hex key for
+        # easy handling. Worked out once per key, see wallet.publicAddress
+        pub_key_hex = publicAddress(signingKey)
         # Ensure the public hex and the sender adddress are the same
         # security check, else raise exception
         if pub_key_hex != self.fromAddress:
             raise Exception('You cannot sign transactions for other wallets!')
 
         # Calculate the hash of this transaction, sign it with the key
-        # and store it inside the transaction object
-        hashTx = self.calculateHash()
-        r, s = ecdsa.sign(hashTx, signingKey, curve=curve.secp256k1)
-        # Did alittle hacking to get the signature into on variable and
-        # hex it for easier handling
-        sig = int(str(r)+str(s))
-
-        self.signature = hex(sig)
+        # and store it inside the transaction object. Signing many
+        # transactions of one wallet is quicker with wallet.Wallet.signMany
+        self.signature = signHash(self.calculateHash(), signingKey)
 
     # Method to check if the transaction is valid
     def isValid(self) -> bool:
@@ -161,29 +268,90 @@ class Transaction:
         if not self.signature or len(self.signature) == 0:
             raise Exception('No signature in this transaction')
 
-        r, s = int(str(int(self.signature, 0))[:77]), int(str(int(self.signature, 0))[77:])
-        pub_key = CurvePoint(int(str(int(self.fromAddress, 0))[:77]), int(str(int(self.fromAddress, 0))[77:]))
-        return ecdsa.verify((r, s), self.calculateHash(), pub_key, curve=curve.secp256k1)
+        # The public key behind an address is decoded once and cached, and so
+        # is the result for signatures that verify
+        return verifySignature(self.calculateHash(), self.signature, self.fromAddress)
 
 
 # Our actual chain of blocks :)
 class Blockchain:
     """
     The chain of all the blocks
+    checkpointPath{string} optional file to keep the validated height in
+    chain{Block[]} optional blocks to start from(like a chainstore.LazyChain),
+    a genesis block is added if it's empty
+
+    Safe to share between threads(or greenlets): everything that changes
+    the chain or the pending list holds self.lock, and the get*Snapshot
+    methods hand out copies that can be rendered without it
     """
     # Creates an instance of an iterable for the class ids
     blockchain_id = itertools.count()
     # Initialize a class with all the required values
-    def __init__(self) -> None:
+    def __init__(self, checkpointPath=None, chain=None) -> None:
         self.id = next(self.blockchain_id)
-        self.chain = [self.createGenesisBlock()]
+        # Reentrant, so the methods that hold it can call each other
+        self.lock = threading.RLock()
+        # Leading zeros of the first target(the genesis block carries it),
+        # and what blocks of chains from before targets are mined at
         self.difficulty = 2
-        self.pendingTransactions = []
+        # The target is worked out again every retargetInterval blocks, so
+        # blocks take targetBlockTime seconds on average
+        self.retargetInterval = 10
+        self.targetBlockTime = 10
+        self.chain = chain if chain is not None else []
+        if len(self.chain) == 0:
+            self.chain.append(self.createGenesisBlock())
+        # The pending transactions, highest fees get mined first
+        self.mempool = Mempool()
+        # The most transactions(not counting the mining reward) put in one block
+        self.maxBlockTransactions = 500
+        # Goes up every time the pending list changes, and lastModified is
+        # when the pending list or the chain last changed. Both let rendered
+        # pages be cached until something they show changes.
+        self.pendingVersion = 0
+        self.lastModified = time()
+        # Functions called with (event, data) whenever a block is added or the
+        # pending list changes, see addListener
+        self.listeners = []
+        # Balances and transactions per address, updated as blocks and
+        # transactions come in so wallet lookups don't walk the chain. It's
+        # only built on the first lookup, so loading a long chain stays quick
+        self._addressIndex = None
+        # Height of every block by its id, filled in as blocks are appended or
+        # looked up, see getBlockById
+        self._heightsById = {}
         self.miningReward = 100
+        # Number of processes used to search for nonces, 1 mines on this process
+        self.miningWorkers = 1
+        # Blocks being mined right now by their id, with the Event that stops
+        # them and the hashes of their transactions the chain took meanwhile
+        # (see replaceBlocks)
+        self._miningBlocks = {}
+        # Number of processes used to check signatures when validating the chain
+        self.verificationWorkers = 1
+        # Height and hash of the last block isChainValid got through, blocks
+        # up to there are not checked again unless a full audit is asked for
+        self.validatedHeight = -1
+        self.validatedHash = None
+        # Goes up every time replaceBlocks swaps blocks, so a check that ran
+        # without the lock can tell the chain changed under it
+        self.chainGeneration = 0
+        self.checkpointPath = checkpointPath
+        self.loadCheckpoint()
+
+    # The address index, built from the chain the first time it's needed
+    @property
+    def addressIndex(self) -> AddressIndex:
+        with self.lock:
+            if self._addressIndex is None:
+                self._addressIndex = AddressIndex.rebuild(self.chain, self.mempool)
+            return self._addressIndex
 
     # Creates a genesis block, which is the 1st block in our chain
+    # It carries the first target, the ones after it follow from there
     def createGenesisBlock(self) -> Block:
-        return Block(floor(time()), [], '0')
+        return Block(floor(time()), [], '0', target=difficultyToTarget(self.difficulty))
 
     # This methods return the latest block in the chain
     def getLatestBlock(self) -> Block:
@@ -191,26 +359,297 @@ class Blockchain:
         Returns the latest block on our chain. Useful when you want to create a
         new Block and you need the hash of the previous Block.
         """
-        return self.chain[len(self.chain) - 1]
+        with self.lock:
+            return self.chain[len(self.chain) - 1]
+
+    # Returns the number of blocks on the chain
+    def getHeight(self) -> int:
+        with self.lock:
+            return len(self.chain)
+
+    # Finds a block by its id
+    def getBlockById(self, blockId: int) -> Optional[Block]:
+        """
+        Returns the block with the given id, or None if there isn't one. Ids
+        only ever go up along the chain, so a block that isn't in the id
+        index yet(like one loaded from a store) is found with a binary search
+        and remembered.
+        """
+        with self.lock:
+            height = self._heightsById.get(blockId)
+            if height is None:
+                low, high = 0, len(self.chain)
+                while low < high:
+                    middle = (low + high) // 2
+                    if self.chain[middle].id < blockId:
+                        low = middle + 1
+                    else:
+                        high = middle
+                if low == len(self.chain) or self.chain[low].id != blockId:
+                    return None
+                height = self._heightsById[blockId] = low
+            return self.chain[height]
+
+    # Works out the target the block at height has to be mined at
+    def getTargetAt(self, height: int, newBlocks: List[Block] = (), start=0) -> Optional[int]:
+        """
+        Returns None on chains from before targets, their blocks are mined at
+        difficulty. Otherwise a block keeps the target of the one before,
+        except every retargetInterval blocks where it's scaled by how long
+        the last retargetInterval blocks took against targetBlockTime each(at
+        most 4 times either way). newBlocks, if given, stand in for the
+        blocks from height start on(like the ones of a peer's chain).
+        """
+        with self.lock:
+            previous = self._blockAt(height - 1, newBlocks, start)
+            if previous.target is None or height % self.retargetInterval != 0:
+                return previous.target
+            firstHeight = max(0, height - 1 - self.retargetInterval)
+            elapsed = previous.timestamp - self._blockAt(firstHeight, newBlocks, start).timestamp
+            return retarget(previous.target, elapsed, (height - 1 - firstHeight) * self.targetBlockTime)
+
+    # The block at height, or the one of newBlocks standing in for it
+    def _blockAt(self, height: int, newBlocks: List[Block] = (), start=0) -> Block:
+        if newBlocks and height >= start:
+            return newBlocks[height - start]
+        return self.chain[height]
+
+    # Checks the block at height carries the target it should and was mined at it
+    def hasValidTarget(self, height: int, newBlocks: List[Block] = (), start=0) -> bool:
+        """
+        Blocks of chains from before targets only need to have none. newBlocks
+        and start are the same as for getTargetAt.
+        """
+        block = self._blockAt(height, newBlocks, start)
+        target = self.getTargetAt(height, newBlocks, start)
+        if block.target != target:
+            return False
+        return target is None or hashMeetsTarget(block.hash, target)
+
+    # The earliest timestamp the block at height can have, the median of the
+    # MEDIAN_TIME_BLOCKS before it
+    def getMinTimestamp(self, height: int, newBlocks: List[Block] = (), start=0) -> int:
+        with self.lock:
+            timestamps = sorted(self._blockAt(i, newBlocks, start).timestamp for i in range(max(0, height - MEDIAN_TIME_BLOCKS), height))
+        return timestamps[len(timestamps) // 2]
+
+    # Checks the block at height isn't dated before the ones it follows, or in the future
+    def hasValidTimestamp(self, height: int, newBlocks: List[Block] = (), start=0) -> bool:
+        """
+        Its timestamp has to be at least getMinTimestamp and at most
+        MAX_FUTURE_SECONDS past our clock. Blocks of chains from before
+        targets don't steer anything with their timestamps and aren't held
+        to it. newBlocks and start are the same as for getTargetAt.
+        """
+        block = self._blockAt(height, newBlocks, start)
+        if block.target is None:
+            return True
+        return self.getMinTimestamp(height, newBlocks, start) <= block.timestamp <= time() + MAX_FUTURE_SECONDS
+
+    # Adds up the work of the blocks from height start to end(not included)
+    def getWork(self, start=0, end=None) -> int:
+        """
+        Blocks of chains from before targets count as mined at difficulty,
+        see hashing.targetWork
+        """
+        with self.lock:
+            blocks = self.chain[start:end]
+        return sum(self.blockWork(block) for block in blocks)
+
+    # The work of one block, see getWork
+    def blockWork(self, block: Block) -> int:
+        return targetWork(block.target if block.target is not None else difficultyToTarget(self.difficulty))
+
+    # The target the next block will be mined at, as a number
+    def getMiningTarget(self) -> int:
+        with self.lock:
+            target = self.getTargetAt(len(self.chain))
+        return target if target is not None else difficultyToTarget(self.difficulty)
+
+    # Returns a copy of (part of) the chain that is safe to use without the lock
+    def getChainSnapshot(self, start=0, end=None) -> List[Block]:
+        with self.lock:
+            return self.chain[start:end]
+
+    # Returns a copy of the pending transactions that is safe to use without the lock
+    def getPendingSnapshot(self) -> List[Transaction]:
+        with self.lock:
+            return list(self.mempool)
 
     # This methods mines all the pending transactions in the block
-    def minePendingTransactions(self, miningRewardAddress: str) -> None:
+    def minePendingTransactions(self, miningRewardAddress: str, progress=None, stop=None) -> bool:
         """
-        Takes all the pending transactions, puts them in a Block and starts the
-        mining process. It also adds a transaction to send the mining reward to
-        the given address.
+        Takes up to maxBlockTransactions pending transactions, the highest
+        fees first, puts them in a Block and starts the mining process. It also
+        adds a transaction to send the mining reward and the fees to the
+        given address. progress and stop are handed to Block.mineBlock, if
+        mining is stopped the transactions go back to the pending list and
+        this returns false. If the chain is replaced meanwhile(see
+        replaceBlocks) mining stops too, the transactions the new blocks
+        don't have go back and this raises.
         """
-        # Create a reward transaction to your address from system for every mined block
-        rewardTx = Transaction(None, miningRewardAddress, self.miningReward)
-        self.pendingTransactions.append(rewardTx)
+        # Held across both, so the chain can't be replaced before the block
+        # is known to be mined on top of it
+        with self.lock:
+            block = self.takePendingTransactions(miningRewardAddress)
+            replaced, confirmed = self._miningBlocks[block.id] = (threading.Event(), set())
 
-        block = Block(floor(time()), self.pendingTransactions, self.getLatestBlock().hash)
-        block.mineBlock(self.difficulty)
+        try:
+            if not block.mineBlock(self.difficulty, self.miningWorkers, progress, AnyEvent(stop, replaced)):
+                self.returnPendingTransactions(block, confirmed)
+                if replaced.is_set():
+                    raise Exception('The chain was replaced while the block was mined')
+                return False
+
+            with self.lock:
+                try:
+                    self.addMinedBlock(block)
+                except Exception:
+                    # Mined just as the chain was replaced
+                    self.returnPendingTransactions(block, confirmed)
+                    raise
+        finally:
+            with self.lock:
+                del self._miningBlocks[block.id]
 
         console.success('Block successfully mined!')
-        self.chain.append(block)
+        return True
 
-        self.pendingTransactions = []
+    # This method hands pending transactions over to a new block to mine
+    def takePendingTransactions(self, miningRewardAddress: str) -> Block:
+        """
+        Takes up to maxBlockTransactions pending transactions(highest fees
+        first) and a mining reward and puts them in a new(not yet mined) block
+        on top of the latest one. The rest stay pending, and transactions keep
+        coming in while the block is mined.
+        """
+        with self.lock:
+            transactions = self.mempool.take(self.maxBlockTransactions)
+            # Create a reward transaction to your address from system for every
+            # mined block, the fees of the block go with it
+            rewardTx = Transaction(None, miningRewardAddress, self.miningReward + sum(tx.fee for tx in transactions))
+            transactions.append(rewardTx)
+
+            # A clock behind the chain's can't date the block before the ones it follows
+            timestamp = max(floor(time()), self.getMinTimestamp(len(self.chain)))
+            block = Block(timestamp, transactions, self.getLatestBlock().hash, target=self.getTargetAt(len(self.chain)))
+
+            self._pendingChanged()
+            if self._addressIndex is not None:
+                for tx in transactions[:-1]:
+                    self._addressIndex.removePending(tx)
+
+            return block
+
+    # This method puts the transactions of a block that wasn't mined back in the pending list
+    def returnPendingTransactions(self, block: Block, confirmed=()) -> None:
+        """
+        Used when mining a block is stopped, everything but the mining reward
+        goes back ahead of the transactions with the same fee that came in
+        meanwhile. If the pool filled up in the meantime the cheapest may not
+        make it back. confirmed{set} hashes of transactions the chain already
+        has, those don't go back.
+        """
+        with self.lock:
+            for tx in reversed([tx for tx in block.transactions if tx.fromAddress is not None and tx.calculateHash() not in confirmed]):
+                try:
+                    self._appendPending(tx, front=True)
+                except Exception as error:
+                    console.error('Dropped transaction {}: {}'.format(tx.id, error))
+            # They went in front, so the pending side of the index is built
+            # again in the mempool's order
+            if self._addressIndex is not None:
+                self._addressIndex.clearPending()
+                for tx in self.mempool:
+                    self._addressIndex.addPending(tx)
+            self._pendingChanged()
+
+    # This method adds a mined block on top of the chain
+    def addMinedBlock(self, block: Block) -> None:
+        """
+        The block must have been built on the latest block, which is always
+        the case as long as blocks are mined one at a time
+        """
+        with self.lock:
+            if block.previousHash != self.getLatestBlock().hash:
+                raise Exception('Block is not built on the latest block of the chain')
+            if not self.hasValidTarget(len(self.chain), [block], len(self.chain)):
+                raise Exception('Block is not mined at the target of the chain')
+            if not self.hasValidTimestamp(len(self.chain), [block], len(self.chain)):
+                raise Exception('Block is dated before the blocks it follows or in the future')
+
+            self.chain.append(block)
+            self._heightsById[block.id] = len(self.chain) - 1
+            self.lastModified = time()
+            self._notify('block', {'block': block, 'height': len(self.chain) - 1})
+            if self._addressIndex is not None:
+                self._addressIndex.addBlock(block, len(self.chain) - 1)
+
+    # This method swaps the end of the chain for the blocks of one with more work
+    def replaceBlocks(self, start: int, blocks: List[Block]) -> None:
+        """
+        Puts blocks in place of the ones from height start on(see sync.py). The
+        blocks must already have been checked, be built on the block before
+        start and have more work(see getWork) than the ones they replace.
+        Pending transactions the new blocks have leave the pending list, and
+        the ones from dropped blocks that are still valid go back on it.
+        """
+        with self.lock:
+            if not 0 <= start <= len(self.chain) or not blocks:
+                raise Exception('There are no new blocks for height {}'.format(start))
+            if blocks[0].previousHash != (self.chain[start - 1].hash if start > 0 else '0'):
+                raise Exception('The new blocks are not built on the chain')
+            # Everything is checked before the old blocks go, a block the
+            # chain(or its store) can't take mustn't leave half a chain behind
+            for height, block in enumerate(blocks, start):
+                if not block.hasValidTypes():
+                    raise Exception('Block at height {} has fields of the wrong type'.format(height))
+            # A new genesis block brings its own first target
+            for height in range(max(start, 1), start + len(blocks)):
+                if not self.hasValidTarget(height, blocks, start):
+                    raise Exception('Block at height {} is not mined at the target of the chain'.format(height))
+                if not self.hasValidTimestamp(height, blocks, start):
+                    raise Exception('Block at height {} is dated before the blocks it follows or in the future'.format(height))
+            if sum(self.blockWork(block) for block in blocks) <= self.getWork(start):
+                raise Exception('The new blocks do not have more work than the ones they replace')
+
+            dropped = self.chain[start:]
+            if dropped:
+                del self.chain[start:]
+            # Ids are our own(they aren't hashed), and have to keep going up
+            # along the chain for getBlockById
+            for block in blocks:
+                block.id = next(Block.block_id)
+                self.chain.append(block)
+            self._heightsById = {blockId: height for blockId, height in self._heightsById.items() if height < start}
+            self.chainGeneration += 1
+            if self.validatedHeight >= start:
+                self.validatedHeight = start - 1
+                self.validatedHash = self.chain[start - 1].hash if start > 0 else None
+                self.saveCheckpoint()
+
+            confirmed = set(tx.calculateHash() for block in blocks for tx in block.transactions)
+            for txHash in confirmed:
+                self.mempool.remove(txHash)
+            # Blocks being mined were built on the old chain, they are stopped
+            # and what the new blocks have won't go back pending
+            for replaced, taken in self._miningBlocks.values():
+                taken.update(confirmed)
+                replaced.set()
+            self._addressIndex = None
+            for tx in [tx for block in dropped for tx in block.transactions]:
+                if tx.fromAddress is not None and tx.calculateHash() not in confirmed:
+                    try:
+                        self.addTransaction(tx)
+                    except Exception as error:
+                        console.error('Dropped transaction {}: {}'.format(tx.id, error))
+
+            self.lastModified = time()
+            if dropped:
+                self._notify('reorg', {'height': start})
+            for height, block in enumerate(blocks, start):
+                self._notify('block', {'block': block, 'height': height})
+            self._pendingChanged()
 
     # This method addds created transactions to the pending list
     def addTransaction(self, transaction: Transaction) -> None:
@@ -231,79 +670,246 @@ class Blockchain:
         if transaction.amount <= 0:
             raise Exception('Transaction amount should be higher than 0')
 
-        self.pendingTransactions.append(transaction)
+        if transaction.fee < 0:
+            raise Exception('Transaction fee cannot be negative')
 
-    # Returns the account balance of a given address
-    def getBalanceOfAddress(self, address: str) -> int:
+        # Only the append itself needs the lock, the checks above don't
+        with self.lock:
+            self._addPending(transaction)
+
+    # This method adds a batch of signed transactions to the pending list
+    def addTransactions(self, transactions: List[Transaction]) -> List[Tuple[str, Optional[str]]]:
         """
-        Returns the balance of a given wallet address.
+        Checks the same things addTransaction does, verifying the signatures
+        over verificationWorkers processes, then adds the good ones in a single
+        locked step. Returns (status, reason) for every transaction in order,
+        status being 'added', 'duplicate'(already pending or earlier in the
+        batch), 'invalid' or 'rejected'(the mempool wouldn't take it).
         """
-        # balance always starts at zero
-        balance = 0
-
-        # Loop through the chain for blocks then
-        for block in self.chain:
-            # loop through blocks for transactions then
-            for trans in block.transactions:
-                # check if the address is yours
-                if trans.fromAddress == address:
-                    # deduce the amount for each transaction made
-                    balance -= trans.amount
+        results = [None] * len(transactions)
+        hashes = [tx.calculateHash() for tx in transactions]
+        for i, tx in enumerate(transactions):
+            if not tx.fromAddress or not tx.toAddress:
+                results[i] = ('invalid', 'Transaction must include from and to address')
+            elif not tx.signature:
+                results[i] = ('invalid', 'No signature in this transaction')
+            elif tx.amount <= 0:
+                results[i] = ('invalid', 'Transaction amount should be higher than 0')
+            elif tx.fee < 0:
+                results[i] = ('invalid', 'Transaction fee cannot be negative')
+
+        unchecked = [i for i, result in enumerate(results) if result is None]
+        valid = verifySignatures([(hashes[i], transactions[i].signature, transactions[i].fromAddress) for i in unchecked],
+                                 self.verificationWorkers)
+        for i, isValid in zip(unchecked, valid):
+            if not isValid:
+                results[i] = ('invalid', 'Cannot add invalid transaction to chain')
+
+        # Only deduplicating and appending need the lock
+        with self.lock:
+            added = 0
+            for i, tx in enumerate(transactions):
+                if results[i] is not None:
+                    continue
+                # Earlier copies in the batch are in the mempool by now
+                if hashes[i] in self.mempool:
+                    results[i] = ('duplicate', 'Transaction is already pending')
+                    continue
+                try:
+                    self._appendPending(tx, hashes[i])
+                except Exception as error:
+                    results[i] = ('rejected', str(error))
+                    continue
+                results[i] = ('added', None)
+                added += 1
+            if added:
+                self._pendingChanged()
+
+        return results
+
+    # Adds an already checked transaction to the pending list and everything
+    # kept with it, the caller holds the lock
+    def _addPending(self, transaction: Transaction) -> None:
+        self._appendPending(transaction)
+        self._pendingChanged()
+
+    # _addPending without marking the list as changed, for batches that do
+    # that once at the end. Raises if the mempool won't take the transaction.
+    def _appendPending(self, transaction: Transaction, txHash=None, front=False) -> None:
+        evicted = self.mempool.add(transaction, txHash, front)
+        # The row goes out before the new count, so listeners never see a
+        # count their table doesn't have yet
+        if not front:
+            self._notify('transaction', {'transaction': transaction, 'index': len(self.mempool) - 1})
+        if self._addressIndex is not None:
+            if evicted is not None:
+                self._addressIndex.removePending(evicted)
+            self._addressIndex.addPending(transaction)
+
+    # Marks the pending list as changed, the caller holds the lock
+    def _pendingChanged(self) -> None:
+        self.pendingVersion += 1
+        self.lastModified = time()
+        self._notify('pending', {'count': len(self.mempool), 'version': self.pendingVersion})
+
+    # Registers a function to be called with (event, data) when the chain changes
+    def addListener(self, listener) -> None:
+        """
+        Events are 'block'({block, height}), 'transaction'({transaction, index}),
+        'pending'({count, version}) and 'reorg'({height}, the blocks from
+        there on were replaced). Listeners are called while the lock
+        is held, so they must be quick(like putting the event on a queue).
+        """
+        self.listeners.append(listener)
 
-                # if its not then
-                if trans.toAddress == address:
-                    # add to your balance for mining rewards
-                    balance += trans.amount
+    # Calls every listener, the caller holds the lock
+    def _notify(self, event: str, data: dict) -> None:
+        for listener in self.listeners:
+            listener(event, data)
 
-        return balance
+    # Returns the account balance of a given address
+    def getBalanceOfAddress(self, address: str, includePending=False) -> int:
+        """
+        Returns the balance of a given wallet address. Pending transactions
+        are only counted if includePending is true.
+        """
+        with self.lock:
+            return self.addressIndex.getBalance(address, includePending)
 
     # This method returns all the transactions from the given wallet address
-    def getAllTransactionsForWallet(self, address: str) -> List[Transaction]:
+    def getAllTransactionsForWallet(self, address: str, includePending=False) -> List[Transaction]:
         """
         Returns a list of all transactions that happened
         to and from the given wallet address.
         """
-        txs = []
+        with self.lock:
+            return self.addressIndex.getTransactions(address, includePending)
 
-        # Loop through the chain then
-        for block in self.chain:
-            # loop through the transactions then
-            for tx in block.transactions:
-                # check where the address is from
-                if (tx.fromAddress == address or tx.toAddress == address):
-                    txs.append(tx)
-
-        return txs
+    # This method checks the address index against a fresh walk of the chain
+    def checkIndexConsistency(self) -> List[str]:
+        """
+        Rebuilds the address index from scratch and returns where it differs
+        from the live one. An empty list means the index is consistent.
+        """
+        with self.lock:
+            rebuilt = AddressIndex.rebuild(self.chain, self.mempool)
+            return self.addressIndex.diff(rebuilt)
 
     # This method checks if the chain has been tapered with
-    def isChainValid(self) -> bool:
+    def isChainValid(self, fullAudit=False) -> bool:
         """
         Loops over all the blocks in the chain and verify if they are properly
         linked together and nobody has tampered with the hashes. By checking
         the blocks it also verifies the(signed) transactions inside of them.
+        Only blocks added since the last successful check are looked at,
+        unless fullAudit is true.
         """
-        # Check if the Genesis block hasn't been tampered with by comparing
-        # the output of createGenesisBlock with the first block on our chain
-        realGenesis = self.createGenesisBlock().hash
-
-        chainValue = self.chain[0].hash
-
-        if realGenesis != chainValue:
-            return False
+        # The blocks are checked without the lock, so mining and wallet pages
+        # don't wait on a long validation. replaceBlocks can swap blocks
+        # meanwhile, then what was checked may be half old and half new
+        # blocks(or not there anymore) and it's all done again.
+        while True:
+            with self.lock:
+                generation = self.chainGeneration
+                end = len(self.chain)
+                start = self.validatedHeight + 1
+                # Start over if asked to, or if the block we stopped at isn't the one
+                # we validated anymore(the chain was replaced or tampered with)
+                if fullAudit or start == 0 or self.chain[self.validatedHeight].hash != self.validatedHash:
+                    start = 0
+
+            try:
+                isValid = self._isRangeValid(start, end)
+            except IndexError:
+                # Blocks only go missing when the chain is cut short
+                with self.lock:
+                    if self.chainGeneration != generation:
+                        continue
+                raise
+
+            with self.lock:
+                if self.chainGeneration != generation:
+                    continue
+                if isValid:
+                    self.validatedHeight = end - 1
+                    self.validatedHash = self.chain[self.validatedHeight].hash
+                    self.saveCheckpoint()
+                return isValid
+
+    # Checks blocks start up to end of the chain, for isChainValid
+    def _isRangeValid(self, start: int, end: int) -> bool:
+        # Check if the Genesis block hasn't been tampered with
+        if start == 0:
+            if not self.isValidGenesisBlock(self.chain[0]):
+                return False
+            start = 1
 
         # Check the remaining blocks on the chain to see if there hashes and
-        # signatures are correct
-        for i in range(1, len(self.chain)):
+        # links are correct, these are cheap so they go first
+        for i in range(start, end):
             currentBlock = self.chain[i]
             previousBlock = self.chain[i - 1]
 
-            if not currentBlock.hasValidTransactions():
+            if not currentBlock.hasValidMerkleRoot():
                 return False
 
             if currentBlock.hash != currentBlock.calculateHash():
                 return False
 
-            if currentBlock.previousHash != previousBlock.calculateHash():
+            # The previous block's hash field has already been checked against
+            # its content, so there is no need to hash it again
+            if currentBlock.previousHash != previousBlock.hash:
                 return False
 
-        return True
+            if not self.hasValidTarget(i) or not self.hasValidTimestamp(i):
+                return False
+
+        # Then the signatures, all in one batch
+        return self.findInvalidTransaction(start, end) is None
+
+    # Checks a block has the shape createGenesisBlock gives it
+    def isValidGenesisBlock(self, block: Block) -> bool:
+        """
+        The genesis block is created with the time the chain started, so
+        instead of comparing it with a fresh one its shape and hash are checked
+        """
+        return (str(block.previousHash) == '0' and len(block.transactions) == 0 and block.hash == block.calculateHash() and
+                (block.target is None or 0 < block.target <= MAX_TARGET))
+
+    # This method finds the first transaction on the chain with a bad signature
+    def findInvalidTransaction(self, start=1, end=None) -> Optional[Tuple[int, int]]:
+        """
+        Verifies the signatures of every transaction on the chain from block
+        start up to end(over verificationWorkers processes) and returns (block
+        index, transaction index) of the first bad one, or None if they are
+        all fine.
+        """
+        return findInvalidTransaction(self.chain, self.verificationWorkers, start, end)
+
+    # Reads the validated height back from checkpointPath, if there is one
+    def loadCheckpoint(self) -> None:
+        """
+        The checkpoint is only trusted if the block at its height is still the
+        one it names, otherwise validation starts from genesis again
+        """
+        if not self.checkpointPath or not os.path.exists(self.checkpointPath):
+            return
+
+        with open(self.checkpointPath) as checkpointFile:
+            checkpoint = json.load(checkpointFile)
+
+        height, blockHash = checkpoint.get('height', -1), checkpoint.get('hash')
+        if 0 <= height < len(self.chain) and self.chain[height].hash == blockHash:
+            self.validatedHeight, self.validatedHash = height, blockHash
+
+    # Writes the validated height to checkpointPath, if there is one
+    def saveCheckpoint(self) -> None:
+        if not self.checkpointPath:
+            return
+
+        # Write to a temporary file and swap it in, so a crash never leaves
+        # half a checkpoint behind
+        temp = self.checkpointPath + '.tmp'
+        with open(temp, 'w') as checkpointFile:
+            json.dump({'height': self.validatedHeight, 'hash': self.validatedHash}, checkpointFile)
+        os.replace(temp, self.checkpointPath)
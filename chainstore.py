@@ -0,0 +1,329 @@
+#!/usr/bin/env python3.5
+import itertools
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Iterator, Optional, Tuple
+
+from blockchain import Block, Transaction
+from merkle import MerkleTree
+
+# Written at the start of the block file so we never read something else as a
+# chain, followed by a byte with the version of the records in it
+MAGIC = b'RBLC'
+# 1 the first records, 2 added transaction fees, 3 added block targets
+VERSION = 3
+# Length prefix of every record in the block file
+RECORD_HEADER = struct.Struct('<I')
+# One entry per block in the index file, the offset of its record
+INDEX_ENTRY = struct.Struct('<Q')
+
+
+## Encoding helpers
+# Integers are zigzag varints, small numbers(most of ours) take a byte or two
+# and big ones(like a user typed amount) still fit
+def _writeInt(out: bytearray, value: int) -> None:
+    value = value * 2 if value >= 0 else -value * 2 - 1
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _readInt(data: bytes, pos: int) -> Tuple[int, int]:
+    value, shift = 0, 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    value = value // 2 if value % 2 == 0 else -(value + 1) // 2
+    return value, pos
+
+
+# Strings are their length + 1 followed by the utf-8 bytes, 0 stands for None
+def _writeStr(out: bytearray, value: Optional[str]) -> None:
+    if value is None:
+        _writeInt(out, 0)
+        return
+    raw = str(value).encode('utf-8')
+    _writeInt(out, len(raw) + 1)
+    out += raw
+
+
+def _readStr(data: bytes, pos: int) -> Tuple[Optional[str], int]:
+    length, pos = _readInt(data, pos)
+    if length == 0:
+        return None, pos
+    end = pos + length - 1
+    return data[pos:end].decode('utf-8'), end
+
+
+# Turns a block into the bytes stored in the block file
+def encodeBlock(block: Block, version=VERSION) -> bytes:
+    """
+    version{number} the record version of the file it goes in, a version 1
+    file can only take transactions without fees and one before version 3
+    blocks without targets
+    """
+    out = bytearray()
+    _writeInt(out, block.id)
+    _writeInt(out, block.timestamp)
+    _writeInt(out, block.nonce)
+    _writeStr(out, block.previousHash)
+    _writeStr(out, block.hash)
+    _writeStr(out, block.merkleRoot)
+    if version >= 3:
+        # Targets are never 0, so 0 stands for None
+        _writeInt(out, block.target or 0)
+    elif block.target is not None:
+        raise ValueError('A version {} block file cannot keep block targets'.format(version))
+    _writeInt(out, len(block.transactions))
+    for tx in block.transactions:
+        _writeInt(out, tx.id)
+        _writeStr(out, tx.fromAddress)
+        _writeStr(out, tx.toAddress)
+        _writeInt(out, tx.amount)
+        _writeInt(out, tx.timestamp)
+        _writeStr(out, tx.signature)
+        if version >= 2:
+            _writeInt(out, tx.fee)
+        elif tx.fee:
+            raise ValueError('A version 1 block file cannot keep transaction fees')
+    return bytes(out)
+
+
+# Turns the bytes from the block file back into a block
+def decodeBlock(data: bytes, version=VERSION) -> Block:
+    """
+    The block is rebuilt field by field without calling __init__, so it
+    doesn't take a new id and keeps the hash it was mined with
+    """
+    block = Block.__new__(Block)
+    block.id, pos = _readInt(data, 0)
+    block.timestamp, pos = _readInt(data, pos)
+    block.nonce, pos = _readInt(data, pos)
+    block.previousHash, pos = _readStr(data, pos)
+    block.hash, pos = _readStr(data, pos)
+    block.merkleRoot, pos = _readStr(data, pos)
+    if version >= 3:
+        block.target, pos = _readInt(data, pos)
+        block.target = block.target or None
+    else:
+        block.target = None
+    count, pos = _readInt(data, pos)
+
+    block.transactions = []
+    for _ in range(count):
+        tx = Transaction.__new__(Transaction)
+        tx.id, pos = _readInt(data, pos)
+        tx.fromAddress, pos = _readStr(data, pos)
+        tx.toAddress, pos = _readStr(data, pos)
+        tx.amount, pos = _readInt(data, pos)
+        tx.timestamp, pos = _readInt(data, pos)
+        tx.signature, pos = _readStr(data, pos)
+        if version >= 2:
+            tx.fee, pos = _readInt(data, pos)
+        else:
+            tx.fee = 0
+        block.transactions.append(tx)
+
+    block.merkleTree = MerkleTree.fromTransactions(block.transactions)
+    return block
+
+
+# Helper to map a whole file, None while it's still empty(mmap can't map those)
+def _mapFile(fileObj) -> Optional[mmap.mmap]:
+    if os.fstat(fileObj.fileno()).st_size == 0:
+        return None
+    return mmap.mmap(fileObj.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+# The append-only block store on disk
+class ChainStore:
+    """
+    directory{string} where blocks.dat and blocks.idx live
+
+    blocks.dat holds length-prefixed block records one after the other and
+    blocks.idx the offset of every record, 8 bytes per block. Both are read
+    through mmap so opening a big chain doesn't load it.
+    """
+    def __init__(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._dataFile = open(os.path.join(directory, 'blocks.dat'), 'a+b')
+        self._indexFile = open(os.path.join(directory, 'blocks.idx'), 'a+b')
+
+        if os.fstat(self._dataFile.fileno()).st_size == 0:
+            self._dataFile.write(MAGIC + bytes([VERSION]))
+            self._dataFile.flush()
+
+        self._data = _mapFile(self._dataFile)
+        if self._data[:len(MAGIC)] != MAGIC:
+            raise Exception('{} is not a block file'.format(self._dataFile.name))
+        # Files written before a version came out are still read(and appended
+        # to) in their own version
+        self.version = self._data[len(MAGIC)]
+        if self.version > VERSION:
+            raise Exception('{} is a version {} block file, only up to {} can be read'.format(self._dataFile.name, self.version, VERSION))
+
+        # A crash between the two writes of append can leave a half written
+        # index entry behind, it's dropped along with its block
+        indexSize = os.fstat(self._indexFile.fileno()).st_size
+        if indexSize % INDEX_ENTRY.size:
+            self._indexFile.truncate(indexSize - indexSize % INDEX_ENTRY.size)
+        self._index = _mapFile(self._indexFile)
+        self._length = os.fstat(self._indexFile.fileno()).st_size // INDEX_ENTRY.size
+
+    def __len__(self) -> int:
+        return self._length
+
+    # Reads the block at the given height
+    def readBlock(self, height: int) -> Block:
+        if not 0 <= height < self._length:
+            raise IndexError('No block at height {}'.format(height))
+
+        # Blocks appended since the files were mapped are past the end of the
+        # maps, so map them again
+        if self._index is None or (height + 1) * INDEX_ENTRY.size > len(self._index):
+            self._remap()
+
+        offset, = INDEX_ENTRY.unpack_from(self._index, height * INDEX_ENTRY.size)
+        if self._data is None or offset + RECORD_HEADER.size > len(self._data):
+            self._remap()
+        length, = RECORD_HEADER.unpack_from(self._data, offset)
+        start = offset + RECORD_HEADER.size
+        return decodeBlock(self._data[start:start + length], self.version)
+
+    # Adds a block at the end of the store
+    def append(self, block: Block) -> None:
+        record = encodeBlock(block, self.version)
+        self._dataFile.seek(0, os.SEEK_END)
+        offset = self._dataFile.tell()
+        self._dataFile.write(RECORD_HEADER.pack(len(record)) + record)
+        self._dataFile.flush()
+        # The index entry goes last, until it's written the block doesn't exist
+        self._indexFile.write(INDEX_ENTRY.pack(offset))
+        self._indexFile.flush()
+        self._length += 1
+
+    # Drops every block from height on, for when the chain moves to a longer fork
+    def truncate(self, height: int) -> None:
+        if not 0 <= height <= self._length:
+            raise IndexError('No block at height {}'.format(height))
+        if height == self._length:
+            return
+
+        if self._index is None or self._length * INDEX_ENTRY.size > len(self._index):
+            self._remap()
+        offset, = INDEX_ENTRY.unpack_from(self._index, height * INDEX_ENTRY.size)
+        # The maps can't stay open over a file that shrinks
+        for mapped in (self._data, self._index):
+            if mapped is not None:
+                mapped.close()
+        self._data = self._index = None
+        # The index goes first, a crash in between only leaves records behind
+        # that nothing points at
+        self._indexFile.truncate(height * INDEX_ENTRY.size)
+        self._indexFile.flush()
+        if height == 0:
+            # Nothing left in the old version, start over in the current one
+            self._dataFile.truncate(0)
+            self._dataFile.write(MAGIC + bytes([VERSION]))
+            self.version = VERSION
+        else:
+            self._dataFile.truncate(offset)
+        self._dataFile.flush()
+        self._length = height
+        self._remap()
+
+    # Returns the highest block id in the store, so new blocks don't reuse ids
+    def lastBlockId(self) -> Optional[int]:
+        if not self._length:
+            return None
+        return self.readBlock(self._length - 1).id
+
+    def _remap(self) -> None:
+        for mapped in (self._data, self._index):
+            if mapped is not None:
+                mapped.close()
+        self._data = _mapFile(self._dataFile)
+        self._index = _mapFile(self._indexFile)
+
+    def close(self) -> None:
+        for mapped in (self._data, self._index):
+            if mapped is not None:
+                mapped.close()
+        self._dataFile.close()
+        self._indexFile.close()
+
+
+# A list-like view of the blocks in a ChainStore, which is what Blockchain.chain
+# becomes when the chain is kept on disk
+class LazyChain:
+    """
+    store{ChainStore}
+    cacheSize{number} how many decoded blocks to keep around
+
+    Blocks are only read from the store when they are asked for, and the
+    most recently used ones are kept decoded. Reads and appends can come from
+    any thread.
+    """
+    def __init__(self, store: ChainStore, cacheSize=1024) -> None:
+        self.store = store
+        self.cacheSize = cacheSize
+        self._cache = OrderedDict()
+        # The store remaps its files and the cache reorders itself on reads,
+        # so reads need the lock just as much as appends
+        self._lock = threading.Lock()
+
+        # Make sure blocks created from now on don't take ids already on disk
+        lastId = store.lastBlockId()
+        if lastId is not None:
+            Block.block_id = itertools.count(lastId + 1)
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __getitem__(self, height):
+        if isinstance(height, slice):
+            return [self[i] for i in range(*height.indices(len(self)))]
+        if height < 0:
+            height += len(self)
+
+        with self._lock:
+            block = self._cache.get(height)
+            if block is None:
+                block = self.store.readBlock(height)
+                self._cache[height] = block
+                if len(self._cache) > self.cacheSize:
+                    self._cache.popitem(last=False)
+            else:
+                self._cache.move_to_end(height)
+            return block
+
+    def __iter__(self) -> Iterator[Block]:
+        for height in range(len(self)):
+            yield self[height]
+
+    # Only the end of the chain can go, like `del chain[height:]`
+    def __delitem__(self, heights) -> None:
+        if not isinstance(heights, slice) or heights.stop is not None or heights.step is not None:
+            raise TypeError('Only the blocks from a height to the end can be deleted')
+        start = heights.indices(len(self))[0]
+
+        with self._lock:
+            self.store.truncate(start)
+            for height in [height for height in self._cache if height >= start]:
+                del self._cache[height]
+
+    def append(self, block: Block) -> None:
+        with self._lock:
+            self.store.append(block)
+            self._cache[len(self) - 1] = block
+            if len(self._cache) > self.cacheSize:
+                self._cache.popitem(last=False)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3.5
+import struct
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Iterable, Iterator, Optional, Tuple, Union
+
+from blockchain import Block, Transaction
+from merkle import MerkleTree
+from verification import decodePublicKey, decodeSignature
+
+# Public keys and signatures are two 32 byte integers each
+INT_SIZE = 32
+
+# The fixed part of a transaction on the wire: sender key, signature, amount,
+# fee, timestamp and whether the receiver is a key(0) or a string(1)
+WIRE_HEADER = struct.Struct('<64s64sqqqB')
+# Length prefix of a receiver that isn't a key
+WIRE_STRING = struct.Struct('<H')
+
+
+## Conversion helpers between the string formats and raw bytes
+# Two integers to 64 raw bytes
+def _packPair(x: int, y: int) -> bytes:
+    return x.to_bytes(INT_SIZE, 'big') + y.to_bytes(INT_SIZE, 'big')
+
+
+def _unpackPair(raw: bytes) -> Tuple[int, int]:
+    return int.from_bytes(raw[:INT_SIZE], 'big'), int.from_bytes(raw[INT_SIZE:], 'big')
+
+
+# The hex of the glued decimal digits, the way addresses and signatures are written
+def _glue(x: int, y: int) -> str:
+    return hex(int(str(x) + str(y)))
+
+
+# An address that is a public key becomes its 64 raw bytes, anything else
+# (like the random text the demo lets you send to) stays a string. Cached so
+# all the transactions of a wallet share one bytes object.
+@lru_cache(maxsize=4096)
+def packAddress(address: Optional[str]) -> Union[bytes, str, None]:
+    if address is None:
+        return None
+    try:
+        pubKey = decodePublicKey(address)
+    except ValueError:
+        return address
+    packed = _packPair(pubKey.x, pubKey.y)
+    # Only keep the bytes if they turn back into the exact same string
+    return packed if _glue(pubKey.x, pubKey.y) == address else address
+
+
+def unpackAddress(address: Union[bytes, str, None]) -> Optional[str]:
+    if isinstance(address, bytes):
+        return _glue(*_unpackPair(address))
+    return address
+
+
+# Hashes are kept as their 32 raw bytes, the genesis block's '0'(or anything
+# that wouldn't come back the same) stays as is
+def packHash(value: str) -> Union[bytes, str]:
+    if len(value) != INT_SIZE * 2:
+        return value
+    try:
+        raw = bytes.fromhex(value)
+    except ValueError:
+        return value
+    return raw if raw.hex() == value else value
+
+
+def unpackHash(value: Union[bytes, str]) -> str:
+    return value.hex() if isinstance(value, bytes) else value
+
+
+# The compact form of a Transaction
+class CompactTransaction:
+    """
+    fromKey{bytes} raw 64 byte public key, None for mining rewards
+    toAddress{bytes|string} raw public key, or the address as given if it isn't one
+    amount{number}
+    timestamp{number}
+    signature{bytes} raw 64 byte (r, s), None if not signed
+    fee{number}
+    """
+    __slots__ = ('id', 'fromKey', 'toAddress', 'amount', 'fee', 'timestamp', 'signature')
+
+    def __init__(self, id: int, fromKey: Optional[bytes], toAddress: Union[bytes, str], amount: int, timestamp: int, signature: Optional[bytes], fee=0) -> None:
+        self.id = id
+        self.fromKey = fromKey
+        self.toAddress = toAddress
+        self.amount = int(amount)
+        self.fee = int(fee)
+        self.timestamp = int(timestamp)
+        self.signature = signature
+
+    # Builds the compact form of a string-based transaction
+    @classmethod
+    def fromTransaction(cls, tx: Transaction) -> 'CompactTransaction':
+        fromKey = packAddress(tx.fromAddress)
+        if isinstance(fromKey, str):
+            raise ValueError('Sender address is not a public key')
+
+        signature = None
+        if tx.signature:
+            candidates = decodeSignature(tx.signature)
+            if not candidates:
+                raise ValueError('Signature is not an (r, s) pair')
+            # Glued digits can sometimes be split in more than one way, but
+            # every split glues back into the same string, so any will do
+            r, s = candidates[0]
+            if _glue(r, s) != tx.signature:
+                raise ValueError('Signature is not written the usual way')
+            signature = _packPair(r, s)
+
+        return cls(tx.id, fromKey, packAddress(tx.toAddress), tx.amount, tx.timestamp, signature, tx.fee)
+
+    # Turns this back into the string-based transaction
+    def toTransaction(self) -> Transaction:
+        tx = Transaction.__new__(Transaction)
+        tx.id = self.id
+        tx.fromAddress = unpackAddress(self.fromKey)
+        tx.toAddress = unpackAddress(self.toAddress)
+        tx.amount = self.amount
+        tx.fee = self.fee
+        tx.timestamp = self.timestamp
+        tx.signature = _glue(*_unpackPair(self.signature)) if self.signature is not None else None
+        return tx
+
+
+# The compact form of a Block
+class CompactBlock:
+    """
+    previousHash, hash and merkleRoot{bytes} raw 32 byte hashes
+    transactions{CompactTransaction[]}
+    target{number} optional, like Block.target
+    """
+    __slots__ = ('id', 'timestamp', 'nonce', 'previousHash', 'hash', 'merkleRoot', 'transactions', 'target')
+
+    def __init__(self, id: int, timestamp: int, nonce: int, previousHash: Union[bytes, str], hash: bytes, merkleRoot: Union[bytes, str], transactions: tuple, target=None) -> None:
+        self.id = id
+        self.timestamp = int(timestamp)
+        self.nonce = nonce
+        self.previousHash = previousHash
+        self.hash = hash
+        self.merkleRoot = merkleRoot
+        self.transactions = transactions
+        self.target = target
+
+    # Builds the compact form of a block
+    @classmethod
+    def fromBlock(cls, block: Block) -> 'CompactBlock':
+        return cls(block.id, block.timestamp, block.nonce, packHash(block.previousHash), packHash(block.hash),
+                   packHash(block.merkleRoot), tuple(CompactTransaction.fromTransaction(tx) for tx in block.transactions), block.target)
+
+    # Turns this back into a block, keeping the hash it was mined with
+    def toBlock(self) -> Block:
+        block = Block.__new__(Block)
+        block.id = self.id
+        block.timestamp = self.timestamp
+        block.nonce = self.nonce
+        block.previousHash = unpackHash(self.previousHash)
+        block.hash = unpackHash(self.hash)
+        block.merkleRoot = unpackHash(self.merkleRoot)
+        block.target = self.target
+        block.transactions = [tx.toTransaction() for tx in self.transactions]
+        block.merkleTree = MerkleTree.fromTransactions(block.transactions)
+        return block
+
+
+## The chain kept in memory
+# A list-like chain that keeps its blocks in compact form, which is what
+# Blockchain.chain becomes when the chain is only kept in memory(see app.py)
+class CompactChain:
+    """
+    blocks{Block[]} optional, the blocks to start with
+    cacheSize{number} how many recently used blocks to keep as Blocks
+
+    Blocks are turned back into Blocks when they are asked for, and the most
+    recently used ones are kept that way. A block that has no compact form
+    (like one with a sender that isn't a public key) is kept as it is. Reads
+    and appends can come from any thread.
+    """
+    def __init__(self, blocks: Iterable[Block] = (), cacheSize=256) -> None:
+        self.cacheSize = cacheSize
+        self._blocks = []
+        self._cache = OrderedDict()
+        # The cache reorders itself on reads, so reads need the lock too
+        self._lock = threading.Lock()
+        for block in blocks:
+            self.append(block)
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+    def __getitem__(self, height):
+        if isinstance(height, slice):
+            return [self[i] for i in range(*height.indices(len(self)))]
+        if height < 0:
+            height += len(self)
+
+        with self._lock:
+            block = self._cache.get(height)
+            if block is None:
+                stored = self._blocks[height]
+                block = stored.toBlock() if isinstance(stored, CompactBlock) else stored
+                self._remember(height, block)
+            else:
+                self._cache.move_to_end(height)
+            return block
+
+    def __iter__(self) -> Iterator[Block]:
+        for height in range(len(self)):
+            yield self[height]
+
+    # Only the end of the chain can go, like `del chain[height:]`
+    def __delitem__(self, heights) -> None:
+        if not isinstance(heights, slice) or heights.stop is not None or heights.step is not None:
+            raise TypeError('Only the blocks from a height to the end can be deleted')
+        start = heights.indices(len(self))[0]
+
+        with self._lock:
+            del self._blocks[start:]
+            for height in [height for height in self._cache if height >= start]:
+                del self._cache[height]
+
+    def append(self, block: Block) -> None:
+        try:
+            stored = CompactBlock.fromBlock(block)
+        except ValueError:
+            stored = block
+        with self._lock:
+            self._blocks.append(stored)
+            self._remember(len(self._blocks) - 1, block)
+
+    # Keeps a decoded block in the cache, the caller holds the lock
+    def _remember(self, height: int, block: Block) -> None:
+        self._cache[height] = block
+        while len(self._cache) > self.cacheSize:
+            self._cache.popitem(last=False)
+
+
+## Wire format for sending many signed transactions at once
+# Packs signed transactions one after the other, see WIRE_HEADER
+def packTransactions(transactions: Iterable[CompactTransaction]) -> bytes:
+    """
+    Mining rewards and unsigned transactions can't be sent, they have no
+    sender key or signature
+    """
+    out = bytearray()
+    for tx in transactions:
+        if tx.fromKey is None or tx.signature is None:
+            raise ValueError('Only signed transactions can be packed')
+        isKey = isinstance(tx.toAddress, bytes)
+        out += WIRE_HEADER.pack(tx.fromKey, tx.signature, tx.amount, tx.fee, tx.timestamp, 0 if isKey else 1)
+        if isKey:
+            out += tx.toAddress
+        else:
+            raw = tx.toAddress.encode('utf-8')
+            out += WIRE_STRING.pack(len(raw)) + raw
+    return bytes(out)
+
+
+# Reads back what packTransactions wrote, raises ValueError on a cut off or
+# malformed record
+def unpackTransactions(data: bytes) -> Iterator[CompactTransaction]:
+    pos = 0
+    while pos < len(data):
+        if pos + WIRE_HEADER.size > len(data):
+            raise ValueError('Transaction record cut off at byte {}'.format(pos))
+        fromKey, signature, amount, fee, timestamp, kind = WIRE_HEADER.unpack_from(data, pos)
+        pos += WIRE_HEADER.size
+
+        if kind == 0:
+            toAddress, pos = bytes(data[pos:pos + INT_SIZE * 2]), pos + INT_SIZE * 2
+        elif kind == 1 and pos + WIRE_STRING.size <= len(data):
+            length, = WIRE_STRING.unpack_from(data, pos)
+            pos += WIRE_STRING.size
+            toAddress, pos = bytes(data[pos:pos + length]).decode('utf-8'), pos + length
+        else:
+            raise ValueError('Bad receiver in transaction record at byte {}'.format(pos))
+        if pos > len(data):
+            raise ValueError('Transaction record cut off at byte {}'.format(pos))
+
+        yield CompactTransaction(next(Transaction.trans_id), fromKey, toAddress, amount, timestamp, signature, fee)
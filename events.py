@@ -0,0 +1,43 @@
+#!/usr/bin/env python3.5
+import queue
+import threading
+from typing import Any
+
+
+# Hands events(new blocks, new transactions, mining progress) to everyone
+# listening, like the browsers on the /_events stream
+class EventBus:
+    """
+    maxQueue{number} how many events a slow listener can fall behind before
+    new ones are dropped for it
+    """
+    def __init__(self, maxQueue=256) -> None:
+        self.maxQueue = maxQueue
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    # Returns a queue that receives every event published from now on
+    def subscribe(self) -> queue.Queue:
+        subscription = queue.Queue(self.maxQueue)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: queue.Queue) -> None:
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    # Sends an event to every subscriber, never blocks the publisher
+    def publish(self, event: str, data: Any) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.put_nowait((event, data))
+            except queue.Full:
+                # A listener this far behind reloads anyway, better than
+                # holding up mining or a request for it
+                pass
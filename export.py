@@ -0,0 +1,318 @@
+#!/usr/bin/env python3.5
+"""
+Streams the chain out as JSON lines(NDJSON), plain or compressed with gzip
+or zstd, and reads such exports back in. Blocks are read, encoded and
+written a batch at a time, so exporting or importing a long chain takes the
+same memory as a short one.
+
+Every line of a full export is a block with its transactions. Exports
+filtered on an address have a line per transaction of that address instead,
+for analytics, and can't be imported.
+
+Run it on a chain store(see REBELCOIN_STORE):
+    python export.py export --store ./chain --output chain.ndjson.gz
+    python export.py export --store ./chain --address 0x1f... --start 100 --end 200
+    python export.py import --store ./copy --input chain.ndjson.gz
+"""
+import argparse
+import json
+import os
+import sys
+import zlib
+from typing import Iterable, Iterator, Optional
+
+from blockchain import Block, Blockchain, Transaction
+from merkle import MerkleTree
+from sync import checkBlocks, checkHeaders
+
+# How many blocks are read from the chain(or from an import) at once
+BATCH_SIZE = 100
+# Bytes of compressed data written out at a time
+CHUNK_SIZE = 64 * 1024
+# Compression formats an export can be in, with the content type and file
+# extension that go with them
+COMPRESSIONS = {
+    'none': ('application/x-ndjson', '.ndjson'),
+    'gzip': ('application/gzip', '.ndjson.gz'),
+    'zstd': ('application/zstd', '.ndjson.zst'),
+}
+# zlib's window bits for a gzip stream, and for reading either gzip or zlib
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+AUTO_WBITS = 32 + zlib.MAX_WBITS
+
+
+## JSON forms of the chain
+def transactionToJSON(tx: Transaction) -> dict:
+    return {
+        'hash': tx.calculateHash(),
+        'fromAddress': tx.fromAddress,
+        'toAddress': tx.toAddress,
+        'amount': tx.amount,
+        'fee': tx.fee,
+        'timestamp': tx.timestamp,
+        'signature': tx.signature,
+    }
+
+
+# Returns item[name] if it's one of the given types(exactly, so True isn't
+# taken for an int), raises ValueError if it isn't
+def _field(item: dict, name: str, *types):
+    value = item.get(name)
+    if type(value) not in types:
+        raise ValueError('{} must be {}'.format(name, ' or '.join('null' if kind is type(None) else kind.__name__ for kind in types)))
+    return value
+
+
+# Rebuilds a transaction from its JSON form, raises ValueError if it isn't one
+def transactionFromJSON(item: dict) -> Transaction:
+    if not isinstance(item, dict):
+        raise ValueError('Transaction must be an object')
+    tx = Transaction(_field(item, 'fromAddress', str, type(None)), _field(item, 'toAddress', str), _field(item, 'amount', int),
+                     _field(item, 'fee', int) if 'fee' in item else 0)
+    tx.timestamp = _field(item, 'timestamp', int)
+    tx.signature = _field(item, 'signature', str, type(None))
+    return tx
+
+
+def blockToJSON(block: Block, height: int) -> dict:
+    return {
+        'height': height,
+        'hash': block.hash,
+        'previousHash': block.previousHash,
+        'merkleRoot': block.merkleRoot,
+        'nonce': block.nonce,
+        'timestamp': block.timestamp,
+        # In hex, a 256 bit number doesn't survive most JSON readers
+        'target': hex(block.target) if block.target is not None else None,
+        'transactions': [transactionToJSON(tx) for tx in block.transactions],
+    }
+
+
+# Rebuilds a block from its JSON form, keeping the hash it was mined with.
+# Raises ValueError if it isn't one.
+def blockFromJSON(item: dict) -> Block:
+    transactions = [transactionFromJSON(tx) for tx in _field(item, 'transactions', list)]
+    target = _field(item, 'target', str, type(None))
+    block = Block(_field(item, 'timestamp', int), transactions, _field(item, 'previousHash', str), MerkleTree.fromTransactions(transactions),
+                  int(target, 16) if target is not None else None)
+    block.merkleRoot = _field(item, 'merkleRoot', str)
+    block.nonce = _field(item, 'nonce', int)
+    block.hash = _field(item, 'hash', str)
+    return block
+
+
+## Export
+# Goes over the records of an export, a batch of blocks at a time
+def exportRecords(blockchain: Blockchain, start=0, end=None, address: Optional[str] = None) -> Iterator[dict]:
+    """
+    start, end{number} the heights to export, end not included(the top of
+    the chain when the export started by default)
+    address{string} optional, only export the transactions from or to it
+    """
+    end = blockchain.getHeight() if end is None else min(end, blockchain.getHeight())
+    for batchStart in range(max(0, start), end, BATCH_SIZE):
+        for height, block in enumerate(blockchain.getChainSnapshot(batchStart, min(batchStart + BATCH_SIZE, end)), batchStart):
+            if address is None:
+                yield blockToJSON(block, height)
+                continue
+            for index, tx in enumerate(block.transactions):
+                if address in (tx.fromAddress, tx.toAddress):
+                    yield dict(transactionToJSON(tx), height=height, blockHash=block.hash, index=index)
+
+
+# Turns records into JSON lines
+def ndjsonLines(records: Iterable[dict]) -> Iterator[bytes]:
+    for record in records:
+        yield (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+# zstd is optional, only needed if it's asked for
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError('zstd needs the zstandard package(pip install zstandard)')
+    return zstandard
+
+
+# Compresses a stream of chunks as it goes, in CHUNK_SIZE pieces
+def compressChunks(chunks: Iterable[bytes], compression='none') -> Iterator[bytes]:
+    if compression == 'none':
+        yield from chunks
+        return
+
+    if compression == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, GZIP_WBITS)
+    elif compression == 'zstd':
+        compressor = _zstandard().ZstdCompressor().compressobj()
+    else:
+        raise ValueError('Unknown compression {}'.format(compression))
+
+    pending = bytearray()
+    for chunk in chunks:
+        pending += compressor.compress(chunk)
+        if len(pending) >= CHUNK_SIZE:
+            yield bytes(pending)
+            pending.clear()
+    pending += compressor.flush()
+    if pending:
+        yield bytes(pending)
+
+
+# The whole export, as the chunks to write out or send
+def exportChain(blockchain: Blockchain, start=0, end=None, address: Optional[str] = None, compression='none') -> Iterator[bytes]:
+    return compressChunks(ndjsonLines(exportRecords(blockchain, start, end, address)), compression)
+
+
+## Import
+def decompressChunks(chunks: Iterable[bytes], compression='none') -> Iterator[bytes]:
+    if compression == 'none':
+        yield from chunks
+        return
+
+    if compression == 'gzip':
+        decompressor = zlib.decompressobj(AUTO_WBITS)
+    elif compression == 'zstd':
+        decompressor = _zstandard().ZstdDecompressor().decompressobj()
+    else:
+        raise ValueError('Unknown compression {}'.format(compression))
+
+    for chunk in chunks:
+        yield decompressor.decompress(chunk)
+    if compression == 'gzip':
+        yield decompressor.flush()
+
+
+# Reads the records of an export back from its chunks, a line at a time
+def readRecords(chunks: Iterable[bytes], compression='none') -> Iterator[dict]:
+    rest = b''
+    for chunk in decompressChunks(chunks, compression):
+        lines = (rest + chunk).split(b'\n')
+        rest = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield json.loads(line.decode('utf-8'))
+    if rest.strip():
+        yield json.loads(rest.decode('utf-8'))
+
+
+# Reads a file in CHUNK_SIZE pieces
+def fileChunks(fileObj) -> Iterator[bytes]:
+    return iter(lambda: fileObj.read(CHUNK_SIZE), b'')
+
+
+# Adds the blocks of a full export on top of the chain
+def importRecords(blockchain: Blockchain, records: Iterable[dict], minDifficulty=1) -> int:
+    """
+    Blocks the chain already has are skipped, so an import that stopped
+    half way can be run again. A chain that only has its own genesis block
+    takes the export's genesis instead. Every batch is checked like blocks
+    from a peer(see sync.py) before it goes on the chain. Returns the number
+    of blocks added, raises ValueError at the first block that doesn't fit.
+    """
+    added = 0
+    batch = []
+
+    def flush():
+        height = blockchain.getHeight()
+        start = batch[0]['height']
+        previousHash = blockchain.getChainSnapshot(start - 1, start)[0].hash if start > 0 else '0'
+        # Built first, which checks every field has the right type
+        blocks = [blockFromJSON(record) for record in batch]
+        checkHeaders(batch, previousHash, minDifficulty)
+        checkBlocks(blockchain, batch, blocks)
+        try:
+            blockchain.replaceBlocks(start, blocks)
+        except Exception as error:
+            raise ValueError('Blocks from height {} do not fit on the chain: {}'.format(start, error))
+        batch.clear()
+        return start + len(blocks) - height
+
+    for record in records:
+        if not isinstance(record, dict) or type(record.get('height')) is not int:
+            raise ValueError('Every line must be a block with its height')
+        if 'transactions' not in record:
+            raise ValueError('Only full exports can be imported, this one is filtered')
+        height = len(batch) + (batch[0]['height'] if batch else blockchain.getHeight())
+        if not batch and record['height'] < height:
+            ours = blockchain.getChainSnapshot(record['height'], record['height'] + 1)[0]
+            if ours.hash == record['hash']:
+                continue
+            # A new chain's genesis is only a placeholder
+            if not (record['height'] == 0 and height == 1):
+                raise ValueError('Block at height {} is not the one on the chain'.format(record['height']))
+            height = 0
+        if record['height'] != height:
+            raise ValueError('Expected the block at height {}, got {}'.format(height, record['height']))
+        batch.append(record)
+        if len(batch) >= BATCH_SIZE:
+            added += flush()
+
+    if batch:
+        added += flush()
+    return added
+
+
+## Command line
+# Works out the compression from the file name if it isn't given
+def compressionFor(path: Optional[str], compression: Optional[str]) -> str:
+    if compression:
+        return compression
+    for name, (_, extension) in COMPRESSIONS.items():
+        if name != 'none' and path and path.endswith(extension[len('.ndjson'):]):
+            return name
+    return 'none'
+
+
+def openStore(directory: str) -> Blockchain:
+    from chainstore import ChainStore, LazyChain
+
+    return Blockchain(os.path.join(directory, 'checkpoint.json'), LazyChain(ChainStore(directory)))
+
+
+def exportCommand(args) -> None:
+    blockchain = openStore(args.store)
+    chunks = exportChain(blockchain, args.start, args.end, args.address, compressionFor(args.output, args.compression))
+    outFile = open(args.output, 'wb') if args.output and args.output != '-' else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            outFile.write(chunk)
+    finally:
+        if outFile is not sys.stdout.buffer:
+            outFile.close()
+
+
+def importCommand(args) -> None:
+    blockchain = openStore(args.store)
+    inFile = open(args.input, 'rb') if args.input and args.input != '-' else sys.stdin.buffer
+    with inFile:
+        added = importRecords(blockchain, readRecords(fileChunks(inFile), compressionFor(args.input, args.compression)))
+    print('Added {} blocks, the chain is {} blocks long'.format(added, blockchain.getHeight()))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    exportParser = commands.add_parser('export', help='write the chain out')
+    exportParser.add_argument('--store', required=True, help='the chain store to export')
+    exportParser.add_argument('--output', help='file to write to, stdout by default')
+    exportParser.add_argument('--start', type=int, default=0, help='first height to export')
+    exportParser.add_argument('--end', type=int, help='height to stop before, the top of the chain by default')
+    exportParser.add_argument('--address', help='only export the transactions from or to this address')
+    exportParser.add_argument('--compression', choices=sorted(COMPRESSIONS), help='worked out from the file name by default')
+    exportParser.set_defaults(run=exportCommand)
+
+    importParser = commands.add_parser('import', help='add the blocks of an export to a chain store')
+    importParser.add_argument('--store', required=True, help='the chain store to add to, made if it is not there')
+    importParser.add_argument('--input', help='file to read from, stdin by default')
+    importParser.add_argument('--compression', choices=sorted(COMPRESSIONS), help='worked out from the file name by default')
+    importParser.set_defaults(run=importCommand)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
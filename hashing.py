@@ -0,0 +1,118 @@
+#!/usr/bin/env python3.5
+from hashlib import sha256
+from math import log
+from typing import Optional, Tuple
+
+# How many nonces are tried before the stop flag is looked at again,
+# checking it on every try would cost more than the hashing itself
+CHECK_INTERVAL = 4096
+# Every hash is below this, a block mined at it takes a single try
+MAX_TARGET = 2 ** 256
+# The most a target moves at one retarget, either way
+MAX_ADJUSTMENT = 4
+
+
+# A hash meets a target when it's below it as a number. Difficulty d(d
+# leading hex zeros) is the same as target 16^(64 - d), a target can be
+# anything in between.
+def difficultyToTarget(difficulty: int) -> int:
+    return 16 ** (64 - difficulty)
+
+
+# The difficulty a target stands for, in hex zeros(not a whole number)
+def targetToDifficulty(target: int) -> float:
+    return 64 - log(target, 16)
+
+
+# Checks a digest against a target without turning it into a number, both
+# are 32 big-endian bytes so comparing the bytes compares the numbers
+def meetsTarget(digest: bytes, target: int) -> bool:
+    return target > 0 and len(digest) == 32 and digest <= _targetLimit(target)
+
+
+# meetsTarget for a hash in hex, like Block.hash. False if it isn't one.
+def hashMeetsTarget(blockHash: str, target: int) -> bool:
+    try:
+        return meetsTarget(bytes.fromhex(blockHash), target)
+    except (TypeError, ValueError):
+        return False
+
+
+# The highest digest that meets target, as bytes
+def _targetLimit(target: int) -> bytes:
+    return (min(target, MAX_TARGET) - 1).to_bytes(32, 'big')
+
+
+# The work a block mined at target stands for, the number of tries it takes
+# on average. Chains are compared by the sum of it.
+def targetWork(target: int) -> int:
+    return MAX_TARGET // max(1, target)
+
+
+# Scales a target by how long blocks actually took against how long they should have
+def retarget(target: int, actualSeconds: int, expectedSeconds: int) -> int:
+    """
+    Blocks that came too quickly make the target lower(mining harder) and
+    slow ones make it higher, by at most MAX_ADJUSTMENT times. The result is
+    kept between 1 and MAX_TARGET.
+    """
+    if expectedSeconds <= 0:
+        return target
+    # Counted in 1/MAX_ADJUSTMENT of a second so it all stays integer maths,
+    # a float can't hold a 256 bit target
+    actual = max(expectedSeconds, min(actualSeconds * MAX_ADJUSTMENT, expectedSeconds * MAX_ADJUSTMENT ** 2))
+    return max(1, min(MAX_TARGET, target * actual // (expectedSeconds * MAX_ADJUSTMENT)))
+
+
+# The hashing engine used while mining
+class BlockHasher:
+    """
+    prefix{bytes} everything the block hashes before the nonce
+
+    The prefix is hashed once and its sha256 state is copied for every nonce,
+    so each try only feeds the few bytes of the nonce
+    """
+    def __init__(self, prefix: bytes) -> None:
+        self._midstate = sha256(prefix)
+
+    # Returns the raw digest for the given nonce
+    def digest(self, nonce: int) -> bytes:
+        state = self._midstate.copy()
+        state.update(str(nonce).encode('ascii'))
+        return state.digest()
+
+    # Returns the digest for the given nonce as a hex string, like Block.calculateHash
+    def hexdigest(self, nonce: int) -> str:
+        return self.digest(nonce).hex()
+
+    # The Proof Of Work loop itself
+    def search(self, target: int, start=0, step=1, maxNonce=None, stop=None, progress=None) -> Tuple[Optional[int], Optional[bytes], int]:
+        """
+        Tries start, start + step, start + 2*step... until a digest meets the
+        target(see meetsTarget). Returns (nonce, digest, tries), nonce and digest are None
+        if maxNonce was reached or stop(an Event) was set before a winner.
+        progress, if given, is called with the number of nonces tried since
+        its last call every CHECK_INTERVAL tries.
+        """
+        midstate = self._midstate
+        # Nothing meets a target of 0, and no digest is at or below empty bytes
+        limit = _targetLimit(target) if target > 0 else b''
+        nonce = start
+        tries = 0
+
+        while stop is None or not stop.is_set():
+            for _ in range(CHECK_INTERVAL):
+                if maxNonce is not None and nonce >= maxNonce:
+                    return None, None, tries
+                state = midstate.copy()
+                state.update(str(nonce).encode('ascii'))
+                digest = state.digest()
+                tries += 1
+                # Same check as meetsTarget, inlined as this is the hottest loop we have
+                if digest <= limit:
+                    return nonce, digest, tries
+                nonce += step
+            if progress is not None:
+                progress(CHECK_INTERVAL)
+
+        return None, None, tries
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3.5
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from typing import Callable, Optional
+
+from console_logging.console import Console
+from hashing import MAX_TARGET, targetToDifficulty
+
+console = Console()
+
+# The least time(in seconds) between two progress updates sent to the listener
+PROGRESS_INTERVAL = 0.5
+
+
+# Keeps track of how far a mining job has come
+class MiningProgress:
+    """
+    target{number} the target the block is mined at, see hashing.meetsTarget
+    """
+    def __init__(self, target: int) -> None:
+        self.target = target
+        self.difficulty = targetToDifficulty(target)
+        self.nonces = 0
+        self.startedAt = time()
+
+    # Called by the mining loop with the number of new nonces tried
+    def __call__(self, tries: int) -> None:
+        self.nonces += tries
+
+    def hashRate(self) -> float:
+        elapsed = time() - self.startedAt
+        return self.nonces / elapsed if elapsed > 0 else 0.0
+
+    # Every try is a fresh target in 2^256 chance no matter how many came
+    # before, so the expected time left is always the time that many tries take
+    def eta(self) -> Optional[float]:
+        rate = self.hashRate()
+        return MAX_TARGET / self.target / rate if rate > 0 else None
+
+
+# A single block being mined in the background
+class MiningJob:
+    """
+    miningRewardAddress{string} who gets the reward for the block
+    target{number}
+    """
+    def __init__(self, miningRewardAddress: str, target: int) -> None:
+        self.id = uuid.uuid4().hex
+        self.miningRewardAddress = miningRewardAddress
+        # queued -> running -> mined | cancelled | failed
+        self.status = 'queued'
+        self.progress = MiningProgress(target)
+        self.stop = threading.Event()
+        self.blockHash = None
+        self.error = None
+
+    # Mined, cancelled or failed, nothing will change anymore
+    def isFinished(self) -> bool:
+        return self.status not in ('queued', 'running')
+
+    def toDict(self) -> dict:
+        return {
+            'id': self.id,
+            'status': self.status,
+            'difficulty': round(self.progress.difficulty, 2),
+            'target': hex(self.progress.target),
+            'nonces': self.progress.nonces,
+            'hashRate': round(self.progress.hashRate(), 2) if self.status == 'running' else None,
+            'eta': self.progress.eta() if self.status == 'running' else None,
+            'blockHash': self.blockHash,
+            'error': self.error,
+        }
+
+
+# Runs mining jobs one after the other on a background thread, so a request
+# never has to wait for the Proof Of Work
+class MiningJobs:
+    """
+    blockchain{Blockchain} the chain to mine blocks for
+    maxJobs{number} how many finished jobs to remember
+    listener{function} optional, called with the job when its status changes
+    and every PROGRESS_INTERVAL seconds while it runs
+    """
+    def __init__(self, blockchain: object, maxJobs=100, listener: Optional[Callable[[MiningJob], None]] = None) -> None:
+        self.blockchain = blockchain
+        self.maxJobs = maxJobs
+        self.listener = listener
+        # One worker, blocks have to be mined one on top of the other anyway
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # Jobs by id, oldest first. Requests on any thread get at it, so it's
+        # only touched with the lock held.
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Queues a new block to be mined and returns its job straight away
+    def submit(self, miningRewardAddress: str) -> MiningJob:
+        job = MiningJob(miningRewardAddress, self.blockchain.getMiningTarget())
+        with self._lock:
+            self.jobs[job.id] = job
+            # Only finished jobs are forgotten, the ones still queued or
+            # running have to stay reachable to be watched and cancelled
+            excess = len(self.jobs) - self.maxJobs
+            if excess > 0:
+                for jobId in [jobId for jobId, old in self.jobs.items() if old.isFinished()][:excess]:
+                    del self.jobs[jobId]
+
+        self._update(job)
+        self.executor.submit(self._run, job)
+        return job
+
+    def get(self, jobId: str) -> Optional[MiningJob]:
+        with self._lock:
+            return self.jobs.get(jobId)
+
+    # Stops a job, returns false if there is no such job or it already finished
+    def cancel(self, jobId: str) -> bool:
+        job = self.get(jobId)
+        if job is None or job.isFinished():
+            return False
+        job.stop.set()
+        return True
+
+    # Tells the listener about the job, if there is one
+    def _update(self, job: MiningJob) -> None:
+        if self.listener is not None:
+            self.listener(job)
+
+    def _run(self, job: MiningJob) -> None:
+        if job.stop.is_set():
+            job.status = 'cancelled'
+            self._update(job)
+            return
+
+        job.status = 'running'
+        # The target may have changed while the job was queued
+        job.progress = MiningProgress(self.blockchain.getMiningTarget())
+        self._update(job)
+
+        # The mining loop reports thousands of times a second, the listener
+        # only hears about it every PROGRESS_INTERVAL
+        lastUpdate = [time()]
+        def progress(tries: int) -> None:
+            job.progress(tries)
+            if time() - lastUpdate[0] >= PROGRESS_INTERVAL:
+                lastUpdate[0] = time()
+                self._update(job)
+
+        try:
+            if self.blockchain.minePendingTransactions(job.miningRewardAddress, progress, job.stop):
+                job.blockHash = self.blockchain.getLatestBlock().hash
+                job.status = 'mined'
+            else:
+                job.status = 'cancelled'
+        except Exception as error:
+            console.error('Mining job {} failed: {}'.format(job.id, error))
+            job.error = str(error)
+            job.status = 'failed'
+        self._update(job)
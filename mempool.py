@@ -0,0 +1,133 @@
+#!/usr/bin/env python3.5
+import heapq
+import itertools
+from collections import OrderedDict, defaultdict
+from typing import Iterator, List, Optional
+
+
+# The pending transactions, waiting to be mined in order of their fee
+class Mempool:
+    """
+    maxSize{number} how many transactions it holds, once full a new one has
+    to pay a higher fee than the cheapest pending one, which is dropped
+    maxPerSender{number} optional, how many pending transactions one address
+    can have
+
+    Transactions are kept by their hash in the order they came, with two
+    heaps over them: the highest fee first for building blocks and the lowest
+    first for eviction. Equal fees go first come first served. Heap entries
+    of transactions that left are skipped when they come up.
+    """
+    def __init__(self, maxSize=10000, maxPerSender=None) -> None:
+        self.maxSize = maxSize
+        self.maxPerSender = maxPerSender
+        # hash -> (sequence number, transaction)
+        self._entries = OrderedDict()
+        # sender address -> hashes of its pending transactions
+        self._bySender = defaultdict(set)
+        self._best = []
+        self._worst = []
+        self._sequence = itertools.count()
+        # Transactions put back in front(see add) count down from here
+        self._frontSequence = itertools.count(-1, -1)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, txHash: str) -> bool:
+        return txHash in self._entries
+
+    # Goes over the pending transactions in the order they came
+    def __iter__(self) -> Iterator[object]:
+        return (tx for _, tx in self._entries.values())
+
+    # Adds a checked transaction, returns the one evicted to make room if any
+    def add(self, tx: object, txHash: Optional[str] = None, front=False) -> Optional[object]:
+        """
+        txHash{string} the hash of tx, if the caller already has it
+        front{boolean} put it ahead of everything with the same fee, for
+        transactions coming back from a block that wasn't mined
+
+        Raises an exception if it's already pending, its sender has
+        maxPerSender transactions pending, or the pool is full of
+        transactions paying as much or more
+        """
+        txHash = txHash or tx.calculateHash()
+        if txHash in self._entries:
+            raise Exception('Transaction is already pending')
+        if self.maxPerSender is not None and len(self._bySender.get(tx.fromAddress, ())) >= self.maxPerSender:
+            raise Exception('Too many pending transactions from this address')
+
+        evicted = None
+        if len(self._entries) >= self.maxSize:
+            cheapest = self._peek(self._worst, -1)
+            if cheapest is None or self._entries[cheapest][1].fee >= tx.fee:
+                raise Exception('Mempool is full, a higher fee is needed')
+            evicted = self.remove(cheapest)
+
+        sequence = next(self._frontSequence) if front else next(self._sequence)
+        self._entries[txHash] = (sequence, tx)
+        if front:
+            self._entries.move_to_end(txHash, last=False)
+        self._bySender[tx.fromAddress].add(txHash)
+        heapq.heappush(self._best, (-tx.fee, sequence, txHash))
+        # Of the cheapest, the newest goes first
+        heapq.heappush(self._worst, (tx.fee, -sequence, txHash))
+        return evicted
+
+    # Takes a transaction out of the pool, returns it(None if it wasn't there)
+    def remove(self, txHash: str) -> Optional[object]:
+        entry = self._entries.pop(txHash, None)
+        if entry is None:
+            return None
+        tx = entry[1]
+        senderHashes = self._bySender[tx.fromAddress]
+        senderHashes.discard(txHash)
+        if not senderHashes:
+            del self._bySender[tx.fromAddress]
+        self._compact()
+        return tx
+
+    # Takes up to count transactions out, the highest fees first
+    def take(self, count: int) -> List[object]:
+        taken = []
+        while len(taken) < count:
+            txHash = self._peek(self._best, 1)
+            if txHash is None:
+                break
+            taken.append(self.remove(txHash))
+        return taken
+
+    # Returns the pending transactions of an address, in the order they came
+    def fromSender(self, address: str) -> List[object]:
+        hashes = sorted(self._bySender.get(address, ()), key=lambda txHash: self._entries[txHash][0])
+        return [self._entries[txHash][1] for txHash in hashes]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bySender.clear()
+        self._best = []
+        self._worst = []
+
+    # Returns the hash at the top of a heap, dropping entries of
+    # transactions that already left. sign is how the heap stores sequence
+    # numbers, 1 for _best and -1 for _worst.
+    def _peek(self, heap: list, sign: int) -> Optional[str]:
+        while heap:
+            txHash = heap[0][2]
+            entry = self._entries.get(txHash)
+            # The hash may be back with another sequence number, only the
+            # newest entry counts
+            if entry is not None and heap[0][1] * sign == entry[0]:
+                return txHash
+            heapq.heappop(heap)
+        return None
+
+    # Rebuilds the heaps once they are mostly entries of transactions that left
+    def _compact(self) -> None:
+        if len(self._best) <= 2 * len(self._entries) + 64:
+            return
+        self._best = [(-tx.fee, sequence, txHash) for txHash, (sequence, tx) in self._entries.items()]
+        self._worst = [(tx.fee, -sequence, txHash) for txHash, (sequence, tx) in self._entries.items()]
+        heapq.heapify(self._best)
+        heapq.heapify(self._worst)
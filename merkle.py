@@ -0,0 +1,109 @@
+#!/usr/bin/env python3.5
+from hashlib import sha256
+from typing import List, Tuple
+
+# Root of a tree with no leaves, same length as any other hash we store
+EMPTY_ROOT = '0' * 64
+
+
+# Hashes two child nodes into their parent
+def hashPair(left: bytes, right: bytes) -> bytes:
+    return sha256(left + right).digest()
+
+
+# A Merkle tree over the hashes of the transactions in a block
+class MerkleTree:
+    """
+    leaves{bytes[]} raw transaction hashes
+
+    Every level is kept so a new leaf only rehashes the path above it and a
+    proof is just a walk up the levels. A level with an odd number of nodes
+    pairs its last node with itself, so [a, b, c] and [a, b, c, c] have the
+    same root. Blocks with the same transaction twice are turned away for
+    that, see Block.hasValidMerkleRoot.
+    """
+    def __init__(self) -> None:
+        self.levels = [[]]
+
+    # Builds a tree for a list of transactions in one go
+    @classmethod
+    def fromTransactions(cls, transactions: List[object]) -> 'MerkleTree':
+        return cls.fromHashes([tx.calculateHash() for tx in transactions])
+
+    # Builds a tree for a list of hex transaction hashes in one go
+    @classmethod
+    def fromHashes(cls, hashes: List[str]) -> 'MerkleTree':
+        tree = cls()
+        for txHash in hashes:
+            tree.append(bytes.fromhex(txHash))
+        return tree
+
+    def __len__(self) -> int:
+        return len(self.levels[0])
+
+    # Adds a leaf and updates the nodes above it, O(log n)
+    def append(self, leaf: bytes) -> None:
+        """
+        Adds the hash of one more transaction to the tree
+        """
+        self.levels[0].append(leaf)
+        index = len(self.levels[0]) - 1
+        level = 0
+
+        # Walk up until we reach a level with a single node(the root)
+        while len(self.levels[level]) > 1:
+            nodes = self.levels[level]
+            parentIndex = index // 2
+            left = nodes[parentIndex * 2]
+            right = nodes[parentIndex * 2 + 1] if parentIndex * 2 + 1 < len(nodes) else left
+
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+            parents = self.levels[level + 1]
+            if parentIndex < len(parents):
+                parents[parentIndex] = hashPair(left, right)
+            else:
+                parents.append(hashPair(left, right))
+
+            index = parentIndex
+            level += 1
+
+    # Returns the root as a hex string, which is what the block header covers
+    def root(self) -> str:
+        if not self.levels[0]:
+            return EMPTY_ROOT
+        return self.levels[-1][0].hex()
+
+    # Builds the proof that the leaf at index is part of this tree
+    def getProof(self, index: int) -> List[Tuple[str, bool]]:
+        """
+        Returns the sibling hashes from the leaf up to the root as
+        (hash, isRight) pairs, isRight tells which side the sibling is on
+        """
+        if not 0 <= index < len(self):
+            raise IndexError('No leaf at index {}'.format(index))
+
+        proof = []
+        for nodes in self.levels[:-1]:
+            siblingIndex = index ^ 1
+            sibling = nodes[siblingIndex] if siblingIndex < len(nodes) else nodes[index]
+            proof.append((sibling.hex(), siblingIndex > index))
+            index //= 2
+
+        return proof
+
+
+# Checks an inclusion proof against a root, without needing the rest of the tree
+def verifyProof(leafHash: str, proof: List[Tuple[str, bool]], root: str) -> bool:
+    """
+    Returns true if the transaction hash leafHash is part of the tree with the
+    given root
+    """
+    node = bytes.fromhex(leafHash)
+    for sibling, isRight in proof:
+        if isRight:
+            node = hashPair(node, bytes.fromhex(sibling))
+        else:
+            node = hashPair(bytes.fromhex(sibling), node)
+
+    return node.hex() == root
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3.5
+import sys
+import threading
+from bisect import bisect_left
+from collections import Counter as Tally
+from time import perf_counter
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+# Histogram buckets(in seconds) when none are given, from a millisecond to a minute
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+# Helper to write label values the way the text format wants them
+def _formatLabels(names: Sequence[str], values: Sequence[object], extra: str = '') -> str:
+    pairs = ['{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+# What counters, gauges and histograms have in common
+class _Metric:
+    """
+    name{string} the name it's exposed under
+    help{string} one line saying what it measures
+    labelNames{string[]} optional, the labels every value is kept apart by
+    fn{function} optional, called on every render for the value instead of
+    it being kept here(for things that already count themselves, like a
+    cache's hits)
+    """
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labelNames: Sequence[str] = (), fn: Optional[Callable[[], float]] = None) -> None:
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labelNames)
+        self.fn = fn
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> Tuple:
+        return tuple(labels.get(name, '') for name in self.labelNames)
+
+    def samples(self):
+        if self.fn is not None:
+            yield self.name, (), self.fn()
+            return
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in sorted(values, key=lambda item: [str(v) for v in item[0]]):
+            yield self.name, key, value
+
+    def render(self) -> str:
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} {}'.format(self.name, self.kind)]
+        for name, key, value in self.samples():
+            lines.append('{}{} {}'.format(name, _formatLabels(self.labelNames, key), float(value)))
+        return '\n'.join(lines)
+
+
+# A number that only goes up
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+# A number that goes up and down
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+# Counts of observations(like request times) per bucket, with their sum
+class Histogram(_Metric):
+    """
+    buckets{number[]} upper bounds of the buckets, in increasing order
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelNames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help, labelNames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket, one for +Inf, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    # Times the block of a with statement
+    def time(self, **labels) -> '_Timer':
+        return _Timer(self, labels)
+
+    def render(self) -> str:
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} histogram'.format(self.name)]
+        for _, key, counts in self.samples():
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts[:-1]):
+                total += count
+                lines.append('{}_bucket{} {}'.format(self.name, _formatLabels(self.labelNames, key, 'le="{}"'.format(bound)), total))
+            lines.append('{}_sum{} {}'.format(self.name, _formatLabels(self.labelNames, key), counts[-1]))
+            lines.append('{}_count{} {}'.format(self.name, _formatLabels(self.labelNames, key), total))
+        return '\n'.join(lines)
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict) -> None:
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> '_Timer':
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.histogram.observe(perf_counter() - self.start, **self.labels)
+
+
+# Every metric of the process, in the order they were made
+class Registry:
+    def __init__(self) -> None:
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    # Adds a metric, a second one with the same name replaces the first(so an
+    # app created twice doesn't end up with two)
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelNames: Sequence[str] = (), fn=None) -> Counter:
+        return self.register(Counter(name, help, labelNames, fn))
+
+    def gauge(self, name: str, help: str, labelNames: Sequence[str] = (), fn=None) -> Gauge:
+        return self.register(Gauge(name, help, labelNames, fn))
+
+    def histogram(self, name: str, help: str, labelNames: Sequence[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelNames, buckets))
+
+    # Returns every metric in the Prometheus text format
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+# Where the metrics of the chain and the app are kept
+REGISTRY = Registry()
+
+# Content type of Registry.render's output
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# Samples the stack of one thread every so often, to see where its time goes
+class SamplingProfiler:
+    """
+    threadId{number} the thread to watch, the one that creates it by default
+    interval{number} seconds between two samples
+
+    Runs on a thread of its own between start and stop, then collapsed()
+    gives the stacks it saw in the format flame graph tools read.
+    """
+    def __init__(self, threadId: Optional[int] = None, interval=0.005) -> None:
+        self.threadId = threadId if threadId is not None else threading.get_ident()
+        self.interval = interval
+        self.samples = Tally()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.threadId)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{}:{}'.format(code.co_filename.rsplit('/', 1)[-1], code.co_name))
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+
+    # One line per stack, outermost call first, with how many samples saw it
+    def collapsed(self) -> str:
+        return '\n'.join('{} {}'.format(stack, count) for stack, count in self.samples.most_common()) + '\n'
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3.5
+import multiprocessing
+from typing import Callable, Optional, Tuple
+
+from hashing import BlockHasher
+
+# How often(in seconds) the parent looks at the stop flag and progress while
+# the workers search
+POLL_INTERVAL = 0.1
+
+# The stop flag and tries counter shared by all the workers of a pool, the flag
+# is set by whichever worker finds a winning nonce first(or by the parent)
+_stopEvent = None
+_triesCounter = None
+
+
+# A stop flag that is set once any of the given ones is, so mining can be
+# stopped by the job(cancelled) or by the chain(replaced) alike
+class AnyEvent:
+    """
+    events{Event[]} None entries are left out
+    """
+    def __init__(self, *events) -> None:
+        self.events = [event for event in events if event is not None]
+
+    def is_set(self) -> bool:
+        return any(event.is_set() for event in self.events)
+
+
+# Runs once in every worker process to hand it the shared stop flag and counter
+def _initWorker(stopEvent, triesCounter) -> None:
+    global _stopEvent, _triesCounter
+    _stopEvent = stopEvent
+    _triesCounter = triesCounter
+
+
+# Adds to the shared tries counter, so the parent can report progress
+def _countTries(tries: int) -> None:
+    with _triesCounter.get_lock():
+        _triesCounter.value += tries
+
+
+# The actual search each worker runs, worker i tries nonces i, i + step, i + 2*step...
+# so the workers never hash the same nonce twice
+def _searchNonces(args: Tuple[bytes, int, int, int, Optional[int]]) -> Tuple[Optional[int], Optional[str], int]:
+    """
+    Returns (nonce, hash, tries) for the winning nonce, or (None, None, tries)
+    if another worker won or the nonce space ran out
+    """
+    prefix, target, start, step, maxNonce = args
+    nonce, digest, tries = BlockHasher(prefix).search(target, start, step, maxNonce, _stopEvent, _countTries)
+    if nonce is not None:
+        _stopEvent.set()
+        return nonce, digest.hex(), tries
+    return None, None, tries
+
+
+# Splits the nonce space over a pool of processes and stops them all as soon
+# as one of them finds a hash that meets the target
+def mineParallel(prefix: bytes, target: int, workers: int, startNonce=0, maxNonce=None,
+                 stop=None, progress: Optional[Callable[[int], None]] = None) -> Tuple[Optional[int], Optional[str], int]:
+    """
+    prefix{bytes} everything the block hashes before the nonce
+    target{number} the hash needs to be below it, see hashing.meetsTarget
+    workers{number} processes to search with
+    stop{Event} optional, stops the search when set
+    progress{function} optional, called with the number of new tries every so often
+
+    Returns (nonce, hash, tries). nonce and hash are None when maxNonce was
+    reached or stop was set without a winner.
+    """
+    stopEvent = multiprocessing.Event()
+    triesCounter = multiprocessing.Value('Q', 0)
+    pool = multiprocessing.Pool(workers, initializer=_initWorker, initargs=(stopEvent, triesCounter))
+    tasks = [(prefix, target, startNonce + i, workers, maxNonce) for i in range(workers)]
+
+    reported = 0
+    try:
+        results = pool.map_async(_searchNonces, tasks)
+        while not results.ready():
+            results.wait(POLL_INTERVAL)
+            if stop is not None and stop.is_set():
+                stopEvent.set()
+            if progress is not None:
+                tried = triesCounter.value
+                progress(tried - reported)
+                reported = tried
+        results = results.get()
+    finally:
+        stopEvent.set()
+        pool.close()
+        pool.join()
+
+    winners = [(nonce, digest) for nonce, digest, _ in results if nonce is not None]
+    totalTries = sum(tries for _, _, tries in results)
+    if progress is not None and totalTries > reported:
+        progress(totalTries - reported)
+
+    nonce, digest = min(winners) if winners else (None, None)
+    return nonce, digest, totalTries
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3.5
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+
+# A bounded least-recently-used cache for rendered HTML fragments
+class RenderCache:
+    """
+    maxSize{number} how many fragments to keep before the oldest go
+
+    Keys should include everything the fragment depends on(a block hash,
+    the pending list version...), entries are never invalidated otherwise
+    """
+    def __init__(self, maxSize=2048) -> None:
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # Returns the cached fragment for key, rendering(and keeping) it if there is none
+    def getOrRender(self, key: Hashable, render: Callable[[], str]) -> str:
+        with self._lock:
+            fragment = self._entries.get(key)
+            if fragment is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return fragment
+            self.misses += 1
+
+        # Rendering happens outside the lock, two threads may render the same
+        # fragment at once but that's cheaper than making everyone wait
+        fragment = render()
+        with self._lock:
+            self._entries[key] = fragment
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last=False)
+        return fragment
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
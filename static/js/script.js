@@ -3,9 +3,10 @@ $(function() {
     $miningInProgress = false;
     /*
     Binding the cards to a click function to
-    AJAX to the server and set the selected block
+    AJAX to the server and set the selected block,
+    delegated so cards added by live updates work too
     */
-    $('.card').bind('click', function () {
+    $(document).on('click', '.card', function () {
         NProgress.start();
         NProgress.configure({ minimum: 0.2 });
         NProgress.inc(0.2);
@@ -79,12 +80,8 @@ $(function() {
             type: 'POST',
             success: function (data) {
                 console.log(data.status + '\n' + data.message);
-                $miningInProgress = false;
-                $('#miningInProgress').attr('hidden', !$miningInProgress);
-                $('#minePendingTransactions').toggle();
-                // $('#minePendingTransactions').attr('hidden', $miningInProgress);
-                NProgress.done();
-                location.href = location.origin;
+                $('#cancelMining').data('job', data.job);
+                watchMiningJob(data.job);
             },
             error: function (error) {
                 alert(error.responseText);
@@ -92,6 +89,105 @@ $(function() {
             }
         });
     });
+    // Shows how far the mining job has come, or what became of it
+    function showMiningJob(job) {
+        if (job.status === 'queued' || job.status === 'running') {
+            $('#miningProgress').text(job.nonces + ' nonces tried' +
+                (job.hashRate ? ', ' + Math.round(job.hashRate) + ' H/s' : '') +
+                (job.eta ? ', about ' + Math.ceil(job.eta) + 's to go' : ''));
+            return;
+        }
+        // The events and the last poll can both bring the end of a job
+        if (!$miningInProgress) {
+            return;
+        }
+        $miningInProgress = false;
+        $('#miningInProgress').attr('hidden', !$miningInProgress);
+        NProgress.done();
+        if (job.status === 'mined') {
+            location.href = location.origin;
+        } else {
+            // Cancelled or failed, the transactions are back in the queue
+            if (job.error) {
+                alert(job.error);
+            }
+            location.reload();
+        }
+    }
+    /*
+    Asks the server how the mining job is doing. Once is enough while the
+    live updates are connected, their 'mining' events bring the rest,
+    otherwise it asks again until the job is done
+    */
+    function watchMiningJob(jobId) {
+        $.getJSON($BASE_URL + "_mining_jobs/" + jobId, function (job) {
+            showMiningJob(job);
+            if ($miningInProgress && !(events && events.readyState === EventSource.OPEN)) {
+                setTimeout(function () { watchMiningJob(jobId); }, 500);
+            }
+        });
+    }
+    // AJAX call to stop the block being mined
+    $('#cancelMining').on('click', function () {
+        $.post($BASE_URL + "_mining_jobs/" + $(this).data('job') + "/cancel", function (data) {
+            console.info('Status: ' + data.status + '\n' + 'Message: ' + data.message);
+        });
+        return false;
+    });
+    /*
+    Live updates from the server, new blocks and pending transactions are
+    added to the page as they come instead of reloading it
+    */
+    function setPendingCount(count) {
+        $('#pendingCount').text(count);
+        $('#pendingButton').attr('hidden', count === 0);
+    }
+    var events = window.EventSource ? new EventSource($BASE_URL + "_events") : null;
+    if (events) {
+        events.addEventListener('open', function () {
+            // Events sent while reconnecting are lost, catch up on the job
+            if ($miningInProgress && $('#cancelMining').data('job')) {
+                watchMiningJob($('#cancelMining').data('job'));
+            }
+        });
+        events.addEventListener('block', function (e) {
+            var block = JSON.parse(e.data);
+            if ($('#blocks').data('live') === true) {
+                $('#blocks').append(block.html);
+            }
+        });
+        events.addEventListener('reorg', function (e) {
+            // A peer had a longer chain, blocks on the page may be gone
+            if ($('#blocks').length) {
+                location.reload();
+            }
+        });
+        events.addEventListener('transaction', function (e) {
+            var tx = JSON.parse(e.data);
+            var $table = $('#pendingTransactions tbody');
+            if ($table.length) {
+                $table.append(tx.html);
+            } else if ($('#pendingTransactions').length) {
+                // First pending transaction, the page has no table yet
+                location.reload();
+            }
+        });
+        events.addEventListener('pending', function (e) {
+            var pending = JSON.parse(e.data);
+            setPendingCount(pending.count);
+            // Some of the queue was taken by a miner(or given back), start over
+            if ($('#pendingTransactions').length && !$miningInProgress &&
+                    pending.count !== $('#pendingTransactions tbody tr').length) {
+                location.reload();
+            }
+        });
+        events.addEventListener('mining', function (e) {
+            var job = JSON.parse(e.data);
+            if (job.id === $('#cancelMining').data('job')) {
+                showMiningJob(job);
+            }
+        });
+    }
     // A little snippet to remove the added transaction alert
     setTimeout(() => {
         $('#addedTrans').alert('close');
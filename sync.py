@@ -0,0 +1,409 @@
+#!/usr/bin/env python3.5
+"""
+Keeps the chains of several nodes in step. A node asks its peers for their
+block headers first, which are small and can be checked without the
+transactions(they link up, hash to what they say and carry their Proof Of
+Work), picks the chain with the most work(see hashing.targetWork) that
+checks out and only then fetches the block bodies, in batches from every peer that has that chain at once. The
+signatures are verified before a single block is taken.
+
+Run a node that syncs from others:
+    python sync.py serve --port 5001 --peers http://127.0.0.1:5000
+
+Or try it all on this machine, with several nodes on loopback:
+    python sync.py loopback --nodes 3 --blocks 5
+"""
+import argparse
+import json
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from typing import List, Sequence
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from blockchain import Block, Blockchain
+from chainstore import RECORD_HEADER, decodeBlock, encodeBlock
+from hashing import difficultyToTarget, hashMeetsTarget, targetWork
+from console_logging.console import Console
+from metrics import REGISTRY
+from verification import findInvalidTransaction
+
+console = Console()
+
+# How many headers or bodies one request asks a peer for, a peer hands out at
+# most its MAX_BLOCKS_PER_PAGE headers at once
+BATCH_SIZE = 100
+# The most headers taken from a peer in one sync, a longer chain is taken a
+# part at a time(see Syncer)
+MAX_HEADERS = 2000
+# Seconds to wait on a peer before giving up on it
+TIMEOUT = 10
+
+# Sync metrics, see metrics.py
+SYNC_RUNS = REGISTRY.counter('rebelcoin_sync_runs_total', 'Syncs with peers, by how they ended', ['outcome'])
+SYNCED_BLOCKS = REGISTRY.counter('rebelcoin_synced_blocks_total', 'Blocks taken from peers')
+
+
+## Block bodies on the wire
+# Blocks go as the records of the chain store(see chainstore.py), one after
+# the other with their length in front
+def packBlocks(blocks: Sequence[Block]) -> bytes:
+    out = bytearray()
+    for block in blocks:
+        record = encodeBlock(block)
+        out += RECORD_HEADER.pack(len(record))
+        out += record
+    return bytes(out)
+
+
+def unpackBlocks(data: bytes) -> List[Block]:
+    blocks = []
+    pos = 0
+    while pos < len(data):
+        length, = RECORD_HEADER.unpack_from(data, pos)
+        pos += RECORD_HEADER.size
+        if pos + length > len(data):
+            raise ValueError('Block record runs past the end of the data')
+        blocks.append(decodeBlock(data[pos:pos + length]))
+        pos += length
+    return blocks
+
+
+## Header checks
+# Works out the hash of a block from its header alone, like Block.calculateHash
+def headerHash(header: dict) -> str:
+    temp = str(header['previousHash']) + str(header['timestamp']) + header['merkleRoot']
+    if header.get('target') is not None:
+        temp += '/{}/'.format(int(header['target'], 16))
+    temp += str(header['nonce'])
+    return sha256(temp.encode('utf-8')).hexdigest()
+
+
+# The work of a block from its header, like Blockchain.blockWork
+def headerWork(header: dict, difficulty: int) -> int:
+    target = header.get('target')
+    return targetWork(int(target, 16) if target is not None else difficultyToTarget(difficulty))
+
+
+# The cheap checks, done on the headers before any body is fetched
+def checkHeaders(headers: List[dict], previousHash: str, minDifficulty: int) -> None:
+    """
+    previousHash{string} hash of the block before the first header, '0' if
+    the first one is a genesis block
+    minDifficulty{number} the fewest leading zeros a mined block may have,
+    or the highest target(see hashing.difficultyToTarget)
+
+    Raises ValueError if the headers don't link up, don't hash to what they
+    say or weren't mined at(or below) their target. Genesis blocks aren't
+    mined. Whether the targets are the ones the chain should have is only
+    checked once the blocks are in, see Blockchain.replaceBlocks.
+    """
+    maxTarget = difficultyToTarget(minDifficulty)
+    for header in headers:
+        if header['previousHash'] != previousHash:
+            raise ValueError('Header at height {} is not linked to the one before'.format(header['height']))
+        if headerHash(header) != header['hash']:
+            raise ValueError('Header at height {} does not match its hash'.format(header['height']))
+        target = int(header['target'], 16) if header.get('target') is not None else None
+        if target is not None and target > maxTarget:
+            raise ValueError('Header at height {} has a target above {}'.format(header['height'], hex(maxTarget)))
+        if header['height'] > 0 and not hashMeetsTarget(header['hash'], target if target is not None else maxTarget):
+            raise ValueError('Header at height {} was not mined'.format(header['height']))
+        previousHash = header['hash']
+
+
+# The full checks, done on the blocks once their headers went through checkHeaders
+def checkBlocks(blockchain: Blockchain, headers: List[dict], blocks: List[Block]) -> None:
+    """
+    Every block has to be the one its header names and still match its hash
+    and merkle root, then all the signatures are verified in one go(over the
+    chain's verificationWorkers). Raises ValueError if anything is off.
+    """
+    if len(blocks) != len(headers):
+        raise ValueError('Got {} blocks for {} headers'.format(len(blocks), len(headers)))
+    for block, header in zip(blocks, headers):
+        target = hex(block.target) if block.target is not None else None
+        if block.hash != header['hash'] or block.previousHash != header['previousHash'] or block.merkleRoot != header['merkleRoot'] or target != header.get('target'):
+            raise ValueError('Block at height {} is not the one its header names'.format(header['height']))
+        if block.calculateHash() != block.hash or not block.hasValidMerkleRoot():
+            raise ValueError('Block at height {} does not match its hash'.format(header['height']))
+
+    if headers and headers[0]['height'] == 0 and not blockchain.isValidGenesisBlock(blocks[0]):
+        raise ValueError('Genesis block is not valid')
+    invalid = findInvalidTransaction(blocks, blockchain.verificationWorkers)
+    if invalid is not None:
+        raise ValueError('Block at height {} has a transaction with a bad signature'.format(headers[invalid[0]]['height']))
+
+
+# One node we sync from, talked to over its HTTP routes
+class Peer:
+    """
+    url{string} where the node's app answers, like http://127.0.0.1:5000
+    """
+    def __init__(self, url: str, timeout=TIMEOUT) -> None:
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _get(self, path: str, **params) -> bytes:
+        with urlopen('{}{}?{}'.format(self.url, path, urlencode(params)), timeout=self.timeout) as response:
+            return response.read()
+
+    # Returns the number of blocks on the peer's chain
+    def height(self) -> int:
+        return json.loads(self._get('/_blocks', cursor=0, limit=1).decode('utf-8'))['height']
+
+    # Returns up to limit headers from height start on(see app.blockHeader)
+    def headers(self, start: int, limit: int) -> List[dict]:
+        page = json.loads(self._get('/_blocks', cursor=start, limit=limit).decode('utf-8'))
+        # A cursor past the end gets the last block instead
+        return [header for header in page['blocks'] if header['height'] >= start]
+
+    # Returns the blocks from height start on, count of them
+    def bodies(self, start: int, count: int) -> List[Block]:
+        return unpackBlocks(self._get('/_block_bodies', start=start, count=count))
+
+
+# Syncs a chain with its peers, once or every so often on a background thread
+class Syncer:
+    """
+    blockchain{Blockchain} the chain to keep up to date
+    peers{string[]} urls of the nodes to sync from
+    minDifficulty{number} the fewest leading zeros a block from a peer may have
+    workers{number} how many batches of bodies are fetched at once
+    maxHeaders{number} the most headers fetched from a peer in one sync
+    """
+    def __init__(self, blockchain: Blockchain, peers: Sequence[str], minDifficulty=1, workers=4, maxHeaders=MAX_HEADERS) -> None:
+        self.blockchain = blockchain
+        self.peers = [Peer(url) for url in peers]
+        self.minDifficulty = minDifficulty
+        self.workers = workers
+        self.maxHeaders = maxHeaders
+        # One sync at a time, two would fetch the same blocks
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Hash of our block at height, '0'(what a genesis block points at) below 0
+    def _ourHash(self, height: int) -> str:
+        if height < 0:
+            return '0'
+        return self.blockchain.getChainSnapshot(height, height + 1)[0].hash
+
+    def _sameBlock(self, peer: Peer, height: int) -> bool:
+        headers = peer.headers(height, 1)
+        return bool(headers) and headers[0]['hash'] == self._ourHash(height)
+
+    # Finds the last block our chain and the peer's have in common
+    def findForkPoint(self, peer: Peer, peerHeight: int) -> int:
+        """
+        Returns its height, -1 if the chains don't even share a genesis block.
+        Steps back from the top in growing steps until a shared block comes
+        up, then narrows down on the fork in between, so it takes a few
+        requests however long the chains are.
+        """
+        mismatch = min(self.blockchain.getHeight(), peerHeight)
+        probe, step = mismatch - 1, 1
+        while probe >= 0 and not self._sameBlock(peer, probe):
+            mismatch = probe
+            probe -= step
+            step *= 2
+
+        low = max(probe, -1)
+        while mismatch - low > 1:
+            middle = (low + mismatch) // 2
+            if self._sameBlock(peer, middle):
+                low = middle
+            else:
+                mismatch = middle
+        return low
+
+    # Fetches and checks the peer's headers after the fork point, at most
+    # maxHeaders of them so a peer claiming a huge height can't fill memory
+    def fetchHeaders(self, peer: Peer, forkPoint: int, peerHeight: int) -> List[dict]:
+        headers = []
+        previousHash = self._ourHash(forkPoint)
+        end = min(peerHeight, forkPoint + 1 + self.maxHeaders)
+        for start in range(forkPoint + 1, end, BATCH_SIZE):
+            page = peer.headers(start, min(BATCH_SIZE, end - start))
+            if not page or [header['height'] for header in page] != list(range(start, start + len(page))):
+                raise ValueError('Peer sent the wrong headers for height {}'.format(start))
+            checkHeaders(page, previousHash, self.minDifficulty)
+            previousHash = page[-1]['hash']
+            headers += page
+        return headers
+
+    # Fetches the bodies of the headers, batches spread over the given peers,
+    # and checks them(see checkBlocks)
+    def fetchBodies(self, peers: List[Peer], headers: List[dict]) -> List[Block]:
+        batches = [headers[i:i + BATCH_SIZE] for i in range(0, len(headers), BATCH_SIZE)]
+
+        def fetch(index: int) -> List[Block]:
+            batch = batches[index]
+            return peers[index % len(peers)].bodies(batch[0]['height'], len(batch))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            blocks = [block for batch in executor.map(fetch, range(len(batches))) for block in batch]
+        checkBlocks(self.blockchain, headers, blocks)
+        return blocks
+
+    # Takes the valid chain with the most work among the peers, if it has more than ours
+    def syncOnce(self) -> str:
+        """
+        Returns 'synced' if blocks were taken, 'current' if no peer has a
+        chain with more work and 'failed' if the ones that do didn't check
+        out. Work is compared from the fork point on, a chain of fewer blocks
+        at lower targets can have more. Only the first maxHeaders blocks of a
+        peer's chain are looked at, once they have more work than ours they
+        are taken and the next sync carries on from there.
+        """
+        with self._lock:
+            candidates = []
+            for peer in self.peers:
+                try:
+                    peerHeight = peer.height()
+                    forkPoint = self.findForkPoint(peer, peerHeight)
+                    # Nothing to take from a peer whose chain is part of ours
+                    if forkPoint >= peerHeight - 1:
+                        continue
+                    headers = self.fetchHeaders(peer, forkPoint, peerHeight)
+                    work = sum(headerWork(header, self.blockchain.difficulty) for header in headers)
+                    if work > self.blockchain.getWork(forkPoint + 1):
+                        candidates.append((work, forkPoint, peer, headers))
+                except Exception as error:
+                    console.error('Could not get headers from {}: {}'.format(peer.url, error))
+
+            if not candidates:
+                SYNC_RUNS.inc(outcome='current')
+                return 'current'
+
+            # Most work first, if its bodies don't check out the next one is tried
+            candidates.sort(key=lambda candidate: -candidate[0])
+            for work, forkPoint, peer, headers in candidates:
+                # Peers on the same chain share the sending of the bodies
+                sources = [other for otherWork, otherFork, other, otherHeaders in candidates
+                           if otherFork == forkPoint and otherHeaders[-1]['hash'] == headers[-1]['hash']]
+                try:
+                    blocks = self.fetchBodies(sources, headers)
+                    self.blockchain.replaceBlocks(forkPoint + 1, blocks)
+                except Exception as error:
+                    console.error('Could not sync from {}: {}'.format(peer.url, error))
+                    continue
+
+                SYNCED_BLOCKS.inc(len(blocks))
+                SYNC_RUNS.inc(outcome='synced')
+                console.success('Synced {} blocks from {}, the chain is {} blocks long'.format(len(blocks), peer.url, self.blockchain.getHeight()))
+                return 'synced'
+
+            SYNC_RUNS.inc(outcome='failed')
+            return 'failed'
+
+    # Syncs every interval seconds on a background thread until stop is called,
+    # straight away again while there are more blocks to take
+    def start(self, interval: float) -> None:
+        def run():
+            while not self._stop.wait(interval):
+                while self.syncOnce() == 'synced' and not self._stop.is_set():
+                    pass
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+## Command line
+# Runs a node, which syncs from its peers if it has any
+def serve(args) -> None:
+    from app import create_app
+
+    app = create_app({'DEMO': args.demo, 'PEERS': args.peers, 'SYNC_INTERVAL': args.interval, 'CHAIN_STORE': args.store})
+    # Load the chain(and start syncing) now rather than on the first request
+    app.extensions['rebelcoin'].blockchain
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+def _request(url: str, method='GET') -> dict:
+    with urlopen(Request(url, data=b'' if method == 'POST' else None, method=method), timeout=TIMEOUT) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+# Starts nodes on loopback, mines on the first and syncs the others from it
+def loopback(args) -> None:
+    urls = ['http://127.0.0.1:{}'.format(args.base_port + i) for i in range(args.nodes)]
+    output = None if args.verbose else subprocess.DEVNULL
+    nodes = []
+    try:
+        for i, url in enumerate(urls):
+            command = [sys.executable, __file__, 'serve', '--port', str(args.base_port + i), '--interval', '0',
+                       '--peers'] + [other for other in urls if other != url]
+            # Only the first node gets the demo block, the others start empty
+            if i == 0:
+                command.append('--demo')
+            nodes.append(subprocess.Popen(command, stdout=output, stderr=output))
+
+        for url in urls:
+            for _ in range(100):
+                try:
+                    _request(url + '/_blocks?limit=1')
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            else:
+                raise Exception('{} did not come up'.format(url))
+
+        for _ in range(args.blocks):
+            job = _request(urls[0] + '/_mine_transactions', 'POST')['job']
+            while _request('{}/_mining_jobs/{}'.format(urls[0], job))['status'] in ('queued', 'running'):
+                time.sleep(0.05)
+
+        # The second node syncs from the first, the ones after it from
+        # whoever has the chain by then
+        for url in urls[1:]:
+            started = time.perf_counter()
+            result = _request(url + '/_sync', 'POST')
+            print('{} {} in {:.3f}s, height {}'.format(url, result['result'], time.perf_counter() - started, result['height']))
+
+        tips = [_request(url + '/_blocks?limit=1')['blocks'][-1]['hash'] for url in urls]
+        if len(set(tips)) != 1:
+            print('The nodes ended up on different chains: {}'.format(tips))
+            sys.exit(1)
+        print('All {} nodes are at {}'.format(len(urls), tips[0]))
+    finally:
+        for node in nodes:
+            node.terminate()
+            node.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    serveParser = commands.add_parser('serve', help='run a node')
+    serveParser.add_argument('--host', default='127.0.0.1')
+    serveParser.add_argument('--port', type=int, default=5000)
+    serveParser.add_argument('--peers', nargs='*', default=[], help='urls of the nodes to sync from')
+    serveParser.add_argument('--interval', type=float, default=10, help='seconds between syncs, 0 only syncs through /_sync')
+    serveParser.add_argument('--store', help='where to keep the chain, like REBELCOIN_STORE')
+    serveParser.add_argument('--demo', action='store_true', help='start a new chain with the demo block')
+    serveParser.set_defaults(run=serve)
+
+    loopbackParser = commands.add_parser('loopback', help='sync several local nodes')
+    loopbackParser.add_argument('--nodes', type=int, default=3)
+    loopbackParser.add_argument('--blocks', type=int, default=5, help='blocks mined on the first node')
+    loopbackParser.add_argument('--base-port', type=int, default=5101, help='port of the first node, the others follow')
+    loopbackParser.add_argument('--verbose', action='store_true', help='show the output of the nodes')
+    loopbackParser.set_defaults(run=loopback)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3.5
+import multiprocessing
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from hashlib import sha256
+from typing import TYPE_CHECKING, List, Optional, Sequence, Tuple
+
+from metrics import REGISTRY
+
+if TYPE_CHECKING:
+    from fastecdsa.point import Point
+
+# How many signatures a worker checks per task, small enough to stop early
+# on a bad one, big enough that the pickling doesn't dominate
+CHUNK_SIZE = 256
+
+# How many verified signatures signatureCache remembers
+SIGNATURE_CACHE_SIZE = 65536
+
+# The field size and group order of secp256k1, the same numbers fastecdsa's
+# curve.secp256k1 has. Kept here so importing this module doesn't import it.
+SECP256K1_P = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEFFFFFC2F
+SECP256K1_Q = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+
+# The longest a coordinate, r or s can be in decimal digits
+MAX_DIGITS = len(str(SECP256K1_P))
+# The shortest we take one to be. They are random numbers below ~10^77, one
+# this short comes up about once in 10^17.
+MIN_DIGITS = 60
+# The most splits tried for one value. Most real signatures have a single
+# one and more than five comes up about once in 100000, while every split of
+# a crafted one costs a full check.
+MAX_SPLITS = 8
+
+
+# Addresses and signatures are two integers glued together in decimal, so
+# there's no fixed place to split them. This returns the splits that could
+# work(both halves MIN_DIGITS to MAX_DIGITS long, MAX_SPLITS at most), the
+# usual 77 digit one first.
+def _splits(value: str, limit: int) -> List[Tuple[int, int]]:
+    digits = str(int(value, 0))
+    positions = sorted(range(MIN_DIGITS, len(digits) - MIN_DIGITS + 1), key=lambda i: abs(i - 77))
+    candidates = []
+    for i in positions:
+        left, right = digits[:i], digits[i:]
+        # str() never gives a leading zero, so neither can a real split
+        if right[0] == '0' or len(left) > MAX_DIGITS or len(right) > MAX_DIGITS:
+            continue
+        x, y = int(left), int(right)
+        if x < limit and y < limit:
+            candidates.append((x, y))
+            if len(candidates) == MAX_SPLITS:
+                break
+    return candidates
+
+
+# Turns a wallet address back into its public key, once per address
+@lru_cache(maxsize=4096)
+def decodePublicKey(address: str) -> 'Point':
+    """
+    Returns the secp256k1 point behind a hex wallet address, raises ValueError
+    if the address isn't one
+    """
+    from fastecdsa import curve
+    from fastecdsa.point import Point
+
+    for x, y in _splits(address, SECP256K1_P):
+        if curve.secp256k1.is_point_on_curve((x, y)):
+            return Point(x, y, curve=curve.secp256k1)
+    raise ValueError('Address is not a public key on secp256k1')
+
+
+# Returns the (r, s) pairs a hex signature could stand for
+def decodeSignature(signature: str) -> List[Tuple[int, int]]:
+    return _splits(signature, SECP256K1_Q)
+
+
+# Remembers which signatures already verified, so a transaction checked when
+# it was added isn't checked again every time the chain is validated
+class SignatureCache:
+    """
+    maxSize{number} how many signatures to remember before the oldest go
+
+    Only good signatures are kept, a bad one is checked again every time.
+    Entries are keyed on a digest of (tx hash, signature, address) so a
+    full cache stays a few megabytes.
+    """
+    def __init__(self, maxSize=SIGNATURE_CACHE_SIZE) -> None:
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _key(txHash: str, signature: str, address: str) -> bytes:
+        return sha256('{}:{}:{}'.format(txHash, signature, address).encode()).digest()
+
+    # Returns true if the signature is known to be good
+    def contains(self, txHash: str, signature: str, address: str) -> bool:
+        key = self._key(txHash, signature, address)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    # Remembers a signature that verified
+    def add(self, txHash: str, signature: str, address: str) -> None:
+        key = self._key(txHash, signature, address)
+        with self._lock:
+            self._entries[key] = True
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# Shared by everything that verifies signatures in this process
+signatureCache = SignatureCache()
+
+# Verification metrics, worker processes keep their own so only signatures
+# checked on this process show up
+VERIFICATIONS = REGISTRY.counter('rebelcoin_signature_verifications_total', 'Elliptic curve signature checks, by result', ['result'])
+VERIFY_SECONDS = REGISTRY.histogram('rebelcoin_signature_verify_seconds', 'Time one signature check takes',
+                                    buckets=(0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1))
+REGISTRY.counter('rebelcoin_signature_cache_hits_total', 'Signatures found in the verified signature cache', fn=lambda: signatureCache.hits)
+REGISTRY.counter('rebelcoin_signature_cache_misses_total', 'Signatures not in the verified signature cache', fn=lambda: signatureCache.misses)
+
+
+# Checks a signature against the hash it signed and the sender's address
+def verifySignature(txHash: str, signature: str, address: str) -> bool:
+    """
+    Returns true if signature is a valid signature of txHash by the owner of
+    address, false for bad signatures and addresses that aren't public keys.
+    Good signatures are remembered in signatureCache.
+    """
+    if signatureCache.contains(txHash, signature, address):
+        return True
+    if _verify(txHash, signature, address):
+        signatureCache.add(txHash, signature, address)
+        return True
+    return False
+
+
+# The elliptic curve check itself, without the cache
+def _verify(txHash: str, signature: str, address: str) -> bool:
+    with VERIFY_SECONDS.time():
+        valid = _verifyPoint(txHash, signature, address)
+    VERIFICATIONS.inc(result='valid' if valid else 'invalid')
+    return valid
+
+
+def _verifyPoint(txHash: str, signature: str, address: str) -> bool:
+    from fastecdsa import curve, ecdsa
+
+    # Anything that can't be decoded(not hex, not even a string) is just a
+    # bad signature, one such transaction mustn't fail a whole batch
+    try:
+        pubKey = decodePublicKey(address)
+        candidates = decodeSignature(signature)
+    except (ValueError, TypeError):
+        return False
+
+    for r, s in candidates:
+        if ecdsa.verify((r, s), txHash, pubKey, curve=curve.secp256k1):
+            return True
+    return False
+
+
+# Runs in the worker processes, returns the position of the first bad
+# signature in the chunk or None if they all check out
+def _verifyChunk(chunk: Sequence[Tuple[str, str, str]]) -> Optional[int]:
+    for i, (txHash, signature, address) in enumerate(chunk):
+        if not signature or not _verify(txHash, signature, address):
+            return i
+    return None
+
+
+# Checks a batch of signatures, on a process pool when workers > 1
+def findInvalidSignature(items: Sequence[Tuple[str, str, str]], workers=1) -> Optional[int]:
+    """
+    items{(txHash, signature, address)[]}
+
+    Returns the position of the first item that doesn't verify, or None if
+    they all do. Items already in signatureCache aren't checked again and
+    the ones that verify are added to it, the worker processes have caches
+    of their own so this happens here.
+    """
+    positions = [i for i, item in enumerate(items) if not item[1] or not signatureCache.contains(*item)]
+    unchecked = [items[i] for i in positions]
+    chunks = [unchecked[i:i + CHUNK_SIZE] for i in range(0, len(unchecked), CHUNK_SIZE)]
+
+    if workers <= 1 or len(chunks) <= 1:
+        results = map(_verifyChunk, chunks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(workers)
+        # imap hands the results back in order, so the first failure we see
+        # is also the first one on the chain
+        results = pool.imap(_verifyChunk, chunks)
+
+    try:
+        for chunkIndex, failure in enumerate(results):
+            chunk = chunks[chunkIndex]
+            for item in chunk[:len(chunk) if failure is None else failure]:
+                signatureCache.add(*item)
+            if failure is not None:
+                return positions[chunkIndex * CHUNK_SIZE + failure]
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    return None
+
+
+# Runs in the worker processes, whether each signature in the chunk checks out
+def _verifyEach(chunk: Sequence[Tuple[str, str, str]]) -> List[bool]:
+    return [bool(signature) and _verify(txHash, signature, address) for txHash, signature, address in chunk]
+
+
+# Checks every signature of a batch, on a process pool when workers > 1
+def verifySignatures(items: Sequence[Tuple[str, str, str]], workers=1) -> List[bool]:
+    """
+    items{(txHash, signature, address)[]}
+
+    Returns whether each item verifies, in the same order. Unlike
+    findInvalidSignature it doesn't stop at the first bad one. Goes through
+    signatureCache the same way.
+    """
+    valid = [bool(item[1]) and signatureCache.contains(*item) for item in items]
+    positions = [i for i, ok in enumerate(valid) if not ok and items[i][1]]
+    unchecked = [items[i] for i in positions]
+    chunks = [unchecked[i:i + CHUNK_SIZE] for i in range(0, len(unchecked), CHUNK_SIZE)]
+
+    if workers <= 1 or len(chunks) <= 1:
+        results = list(map(_verifyEach, chunks))
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            results = pool.map(_verifyEach, chunks)
+
+    for position, item, ok in zip(positions, unchecked, (ok for chunk in results for ok in chunk)):
+        if ok:
+            signatureCache.add(*item)
+            valid[position] = True
+    return valid
+
+
+# Finds the first transaction on a chain with a bad signature
+def findInvalidTransaction(blocks: Sequence[object], workers=1, start=0, end=None) -> Optional[Tuple[int, int]]:
+    """
+    Returns (block index, transaction index) of the first transaction in
+    blocks[start:end] whose signature doesn't verify, or None if they all do.
+    Mining rewards have no sender and are skipped.
+    """
+    items = []
+    positions = []
+    for blockIndex in range(start, len(blocks) if end is None else end):
+        block = blocks[blockIndex]
+        for txIndex, tx in enumerate(block.transactions):
+            if tx.fromAddress is None:
+                continue
+            items.append((tx.calculateHash(), tx.signature, tx.fromAddress))
+            positions.append((blockIndex, txIndex))
+
+    failure = findInvalidSignature(items, workers)
+    return positions[failure] if failure is not None else None
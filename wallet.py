@@ -0,0 +1,86 @@
+#!/usr/bin/env python3.5
+import multiprocessing
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+# How many transactions a worker process signs per task
+CHUNK_SIZE = 256
+
+
+# Works out the address of a private key: its public key with the x and y
+# digits glued together, in hex. The scalar multiplication behind it is the
+# slow part, so the last few keys are remembered.
+@lru_cache(maxsize=64)
+def publicAddress(privateKey: int) -> str:
+    # Imported here, loading and serving the chain never needs to sign
+    from fastecdsa import curve, keys
+
+    pubKey = keys.get_public_key(privateKey, curve.secp256k1)
+    return hex(int(str(pubKey.x) + str(pubKey.y)))
+
+
+# Signs a transaction hash, r and s glued together the same way as addresses
+def signHash(txHash: str, privateKey: int) -> str:
+    from fastecdsa import curve, ecdsa
+
+    r, s = ecdsa.sign(txHash, privateKey, curve=curve.secp256k1)
+    return hex(int(str(r) + str(s)))
+
+
+# Runs in the worker processes
+def _signChunk(task: Tuple[int, Sequence[str]]) -> List[str]:
+    privateKey, hashes = task
+    return [signHash(txHash, privateKey) for txHash in hashes]
+
+
+# A private key with its address, worked out once
+class Wallet:
+    """
+    privateKey{number}
+    """
+    def __init__(self, privateKey: int) -> None:
+        self.privateKey = privateKey
+        self.address = publicAddress(privateKey)
+
+    # Makes a wallet with a brand new key
+    @classmethod
+    def generate(cls) -> 'Wallet':
+        from fastecdsa import curve, keys
+
+        return cls(keys.gen_private_key(curve.secp256k1))
+
+    # Makes a wallet from a key in hex(like REBELCOIN_PRIVATE_KEY) or a number
+    @classmethod
+    def fromKey(cls, key) -> 'Wallet':
+        return cls(int(key, 16) if isinstance(key, str) else key)
+
+    def _checkSender(self, tx: object) -> None:
+        if tx.fromAddress != self.address:
+            raise Exception('You cannot sign transactions for other wallets!')
+
+    # Signs one transaction sent from this wallet
+    def sign(self, tx: object) -> None:
+        self._checkSender(tx)
+        tx.signature = signHash(tx.calculateHash(), self.privateKey)
+
+    # Signs many transactions sent from this wallet, on a process pool when workers > 1
+    def signMany(self, transactions: Sequence[object], workers: Optional[int] = 1) -> None:
+        """
+        Every transaction is checked to be from this wallet before any is
+        signed. workers None uses a process per CPU. Signing is
+        deterministic(RFC 6979), so the signatures are the same however many
+        workers there are.
+        """
+        for tx in transactions:
+            self._checkSender(tx)
+        hashes = [tx.calculateHash() for tx in transactions]
+        tasks = [(self.privateKey, hashes[i:i + CHUNK_SIZE]) for i in range(0, len(hashes), CHUNK_SIZE)]
+
+        if len(tasks) <= 1 or (workers is not None and workers <= 1):
+            results = map(_signChunk, tasks)
+        else:
+            with multiprocessing.Pool(workers) as pool:
+                results = pool.map(_signChunk, tasks)
+
+        for tx, signature in zip(transactions, (signature for chunk in results for signature in chunk)):
+            tx.signature = signature